@@ -10,7 +10,7 @@ from celery.canvas import Signature
 from celery.result import AsyncResult
 from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, Response
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from scout_apm.async_.starlette import ScoutMiddleware
 
 from app.constants import ALLOWED_MIME_TYPES
@@ -87,35 +87,48 @@ def get_upload_url(request: Request, content_type: str = input_mimetypes_regex):
 @app.post("/api/request-prediction")
 def request_prediction(image_name: str):
     models = ["spaces", "walls", "icons_v1"]
-    task_group = group(
-        *[
-            Signature(
-                task="predictors.tasks.prediction_tasks.prediction_task",
-                app=celery_app,
-                immutable=True,
-                kwargs=dict(
-                    input_image={"blob_name": image_name},
-                    model=model,
-                    result_types=["json", "svg"],
-                ),
-            )
-            for model in models
-        ]
-    ) | group(
+    # the regions of interest are predicted once and passed on to all models
+    task_group = (
         Signature(
-            "predictors.tasks.prediction_tasks.statistics_task",
+            task="predictors.tasks.prediction_tasks.roi_task",
             app=celery_app,
-        ),
-        Signature(
-            "predictors.tasks.prediction_tasks.background_mask_task",
             kwargs=dict(input_image={"blob_name": image_name}),
-            app=celery_app,
-        ),
+        )
+        | group(
+            *[
+                Signature(
+                    task="predictors.tasks.prediction_tasks.prediction_task",
+                    app=celery_app,
+                    kwargs=dict(
+                        input_image={"blob_name": image_name},
+                        model=model,
+                        # the statistics and background tasks read the wkb
+                        result_types=["json", "svg", "wkb"],
+                    ),
+                )
+                for model in models
+            ]
+        )
+        | group(
+            Signature(
+                "predictors.tasks.prediction_tasks.statistics_task",
+                app=celery_app,
+            ),
+            Signature(
+                "predictors.tasks.prediction_tasks.background_mask_task",
+                kwargs=dict(input_image={"blob_name": image_name}),
+                app=celery_app,
+            ),
+        )
     )
     statistics_result, background_result = group_result = task_group.delay()
 
     spaces_result, wall_result, icon_result = group_result.parent
+    roi_result = group_result.parent.parent
     return {
+        "roi_task": {
+            "id": roi_result.id,
+        },
         "wall_task": {
             "id": wall_result.id,
         },
@@ -170,8 +183,12 @@ def retrieve_task_result(task_id: str, content_type: str):
     if task_result.ready():
         try:
             result = task_result.get(follow_parents=True)
-            if signed_url := result.get(content_type, {}).get("signed_url"):
+            blob = result.get(content_type)
+            if isinstance(blob, dict) and (signed_url := blob.get("signed_url")):
                 return RedirectResponse(signed_url)
+            # results without blobs, e.g. the regions of interest of the roi_task
+            if content_type == "json" and blob is None:
+                return JSONResponse(result)
             return Response(status_code=404)
         except InputImageException:
             return Response(status_code=424)
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import click
+import torch
+
+from predictors.predictors.utils.inference import export_onnx, export_torchscript
+from predictors.predictors.walls import WallPredictor
+
+
+@click.command()
+@click.option(
+    "-model_path",
+    "-m",
+    type=click.Path(exists=True, path_type=Path),
+    default=WallPredictor.TORCH_MODEL_PATH,
+    help="Pickled torch module of the walls model",
+)
+@click.option(
+    "-output_format",
+    "-f",
+    type=click.Choice(["torchscript", "onnx", "all"]),
+    default="all",
+)
+@click.option("-tile_size", "-t", type=click.INT, default=WallPredictor.TILE_SIZE)
+def export_walls_model(model_path, output_format, tile_size):
+    """Exports the walls model next to the pickled module, such that the prediction
+    workers can run it with WALLS_INFERENCE_BACKEND=torchscript|onnx"""
+    model = torch.load(model_path, map_location=torch.device("cpu"))
+
+    if output_format in ("torchscript", "all"):
+        output_path = model_path.with_suffix(".pt")
+        export_torchscript(model=model, output_path=output_path, tile_size=tile_size)
+        click.echo(f"Exported TorchScript model to {output_path}")
+
+    if output_format in ("onnx", "all"):
+        output_path = model_path.with_suffix(".onnx")
+        export_onnx(model=model, output_path=output_path, tile_size=tile_size)
+        click.echo(f"Exported ONNX model to {output_path}")
+
+
+if __name__ == "__main__":
+    export_walls_model()
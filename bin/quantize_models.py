@@ -0,0 +1,222 @@
+import json
+from pathlib import Path
+
+import click
+import cv2
+import numpy as np
+import torch
+
+from predictors.predictors.utils.tiling import (
+    batched,
+    get_image_tile_bounds,
+    pad_image_if_needed,
+)
+
+COCO_DIRECTORY = Path("data/coco")
+
+
+def _validation_images(coco_directory: Path, max_images: int):
+    validation_directory = coco_directory.joinpath("validation")
+    with validation_directory.joinpath("coco.json").open() as f:
+        coco = json.load(f)
+    for image in sorted(coco["images"], key=lambda i: i["id"])[:max_images]:
+        yield cv2.imread(
+            validation_directory.joinpath("images", image["file_name"]).as_posix()
+        )
+
+
+def _walls_calibration_batches(predictor, images):
+    for image in images:
+        width, height = image.shape[:2]
+        tiles = [
+            pad_image_if_needed(
+                image[x1:x2, y1:y2, :],
+                min_width=predictor.TILE_SIZE,
+                min_height=predictor.TILE_SIZE,
+            )
+            for x1, y1, x2, y2 in get_image_tile_bounds(
+                width=width,
+                height=height,
+                tile_size=predictor.TILE_SIZE,
+                tile_stride=predictor.TILE_SIZE - predictor.TILE_OVERLAP,
+            )
+        ]
+        for batch in batched(tiles, predictor.tile_batch_size):
+            yield predictor.preprocess_batch(np.stack(batch))
+
+
+def _walls_regression_report(fp32_predictor, int8_predictor, images, threshold):
+    intersections, unions, absolute_errors = 0, 0, []
+    for image in images:
+        fp32_mask = fp32_predictor.predict_tiled(image).astype(np.float32)
+        int8_mask = int8_predictor.predict_tiled(image).astype(np.float32)
+        intersections += np.sum(
+            (fp32_mask > threshold) & (int8_mask > threshold), axis=(1, 2)
+        )
+        unions += np.sum((fp32_mask > threshold) | (int8_mask > threshold), axis=(1, 2))
+        absolute_errors.append(np.abs(fp32_mask - int8_mask).mean(axis=(1, 2)))
+
+    mean_absolute_errors = np.mean(absolute_errors, axis=0)
+    return {
+        label.name: {
+            "IoU": float(intersections[i] / unions[i]) if unions[i] else float("nan"),
+            "mean_absolute_error": float(mean_absolute_errors[i]),
+        }
+        for i, label in enumerate(fp32_predictor.CLASSES)
+    }
+
+
+def _tiled_model(predictor):
+    """Runs the tiled prediction served in production on the images of the data
+    loader's batches instead of the model on the full images"""
+
+    def model(batched_inputs):
+        return [predictor(cv2.imread(inputs["file_name"])) for inputs in batched_inputs]
+
+    return model
+
+
+def _detectron_evaluation(predictor, dataset_name, dataset_dicts, thing_classes):
+    from detectron2.data import build_detection_test_loader
+    from detectron2.evaluation import inference_on_dataset
+
+    from detectron.evaluator import BBoxEvaluator, COCOEvaluatorDetailed
+
+    bbox_evaluations, _, _ = BBoxEvaluator(
+        predictor=predictor,
+        dataset_dicts=dataset_dicts,
+        thing_classes=thing_classes,
+        min_score=predictor.cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST,
+    ).evaluate()
+    coco_evaluations = inference_on_dataset(
+        _tiled_model(predictor),
+        build_detection_test_loader(predictor.cfg, dataset_name),
+        COCOEvaluatorDetailed(dataset_name, output_dir=None),
+    )
+    return {"bbox": bbox_evaluations, "coco": coco_evaluations}
+
+
+def _print_report(report):
+    click.echo(json.dumps(report, indent=3, default=float))
+
+
+@click.group()
+def quantize_models():
+    """Offline post-training INT8 quantization of the prediction models, the
+    quantized models are used by the workers if PREDICTORS_QUANTIZED is set"""
+
+
+@quantize_models.command()
+@click.option(
+    "-coco_directory",
+    "-d",
+    type=click.Path(exists=True, path_type=Path),
+    default=COCO_DIRECTORY,
+)
+@click.option("-calibration_images", "-n", type=click.INT, default=32)
+@click.option("-evaluation_images", "-e", type=click.INT, default=64)
+@click.option("-threshold", "-t", type=click.FLOAT, default=0.5)
+def walls(coco_directory, calibration_images, evaluation_images, threshold):
+    """Static quantization of the walls model calibrated on the COCO validation set"""
+    from predictors.predictors.utils.quantization import quantize_walls_model
+    from predictors.predictors.walls import WallPredictor
+
+    # calibrated and compared on CPU like the quantized model is run
+    fp32_predictor = WallPredictor(backend="torch", device="cpu")
+    quantized_model = quantize_walls_model(
+        model=fp32_predictor.model.model,
+        calibration_batches=_walls_calibration_batches(
+            fp32_predictor, _validation_images(coco_directory, calibration_images)
+        ),
+    )
+    torch.jit.save(quantized_model, WallPredictor.QUANTIZED_MODEL_PATH.as_posix())
+    click.echo(f"Saved quantized model to {WallPredictor.QUANTIZED_MODEL_PATH}")
+
+    _print_report(
+        _walls_regression_report(
+            fp32_predictor=fp32_predictor,
+            int8_predictor=WallPredictor(quantized=True),
+            images=_validation_images(coco_directory, evaluation_images),
+            threshold=threshold,
+        )
+    )
+
+
+@quantize_models.command()
+@click.option(
+    "-model",
+    "-m",
+    type=click.Choice(["icons_v1", "icons_v2", "spaces"]),
+    default="icons_v2",
+)
+@click.option(
+    "-coco_directory",
+    "-d",
+    type=click.Path(exists=True, path_type=Path),
+    default=COCO_DIRECTORY,
+)
+@click.option(
+    "-thing_classes",
+    "-c",
+    type=click.STRING,
+    multiple=True,
+    help="Dataset classes in the order of the model's classes, defaults to the "
+    "<LABEL>_UNION classes of the icon models",
+)
+def detectron(model, coco_directory, thing_classes):
+    """Accuracy regression of the dynamically quantized detectron2 models against
+    fp32 on the COCO validation set (the weights are quantized on model load)"""
+    from detectron2.data import DatasetCatalog
+    from detectron2.data.datasets import register_coco_instances
+
+    from detectron.dataset_utils import filter_coco_json
+    from predictors.predictors.icons import IconPredictor
+    from predictors.predictors.spaces import SpacePredictor
+
+    def get_predictor(quantized):
+        if model == "spaces":
+            return SpacePredictor(quantized=quantized)
+        return IconPredictor(version=int(model[-1]), quantized=quantized)
+
+    fp32_predictor, int8_predictor = get_predictor(False), get_predictor(True)
+    if not thing_classes:
+        if model == "spaces":
+            raise click.UsageError("-thing_classes is required for the spaces model")
+        thing_classes = [
+            f"{label.name}_UNION"
+            for label in fp32_predictor.icon_model_config.class_labels
+        ]
+
+    dataset_name = f"quantization-validation-{model}"
+    filtered_coco_json = Path(f"coco-{dataset_name}-filtered.json")
+    filter_coco_json(
+        input_filename=coco_directory.joinpath("validation", "coco.json"),
+        output_filename=filtered_coco_json,
+        thing_classes=list(thing_classes),
+    )
+    register_coco_instances(
+        dataset_name,
+        {},
+        filtered_coco_json.as_posix(),
+        coco_directory.joinpath("validation", "images").as_posix(),
+    )
+    dataset_dicts = DatasetCatalog.get(dataset_name)
+
+    _print_report(
+        {
+            precision: _detectron_evaluation(
+                predictor=predictor.predictor,
+                dataset_name=dataset_name,
+                dataset_dicts=dataset_dicts,
+                thing_classes=list(thing_classes),
+            )
+            for precision, predictor in [
+                ("fp32", fp32_predictor),
+                ("int8", int8_predictor),
+            ]
+        }
+    )
+
+
+if __name__ == "__main__":
+    quantize_models()
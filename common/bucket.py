@@ -1,12 +1,40 @@
 import os
+from functools import lru_cache
 
 from google.cloud import storage
 
 
-def get_bucket():
-    storage_client = storage.Client.from_service_account_json(
+@lru_cache(maxsize=None)
+def get_storage_client() -> storage.Client:
+    """Process wide client, its HTTP session and connection pool are reused for all
+    requests. If STORAGE_EMULATOR_HOST is set, e.g. to a local fake-gcs-server, the
+    client connects to it without credentials."""
+    if os.getenv("STORAGE_EMULATOR_HOST"):
+        from google.auth.credentials import AnonymousCredentials
+
+        return storage.Client(
+            credentials=AnonymousCredentials(),
+            project=os.getenv("STORAGE_EMULATOR_PROJECT", "test"),
+        )
+    return storage.Client.from_service_account_json(
         json_credentials_path=os.getenv("ML_IMAGES_BUCKET_CREDENTIALS_FILE")
     )
-    return storage_client.get_bucket(
-        bucket_or_name=os.getenv("AUTO_UPLOADED_IMAGES_BUCKET")
+
+
+@lru_cache(maxsize=None)
+def get_bucket() -> storage.Bucket:
+    """The bucket is referenced without fetching its metadata, blobs can be read
+    and written without it"""
+    return get_storage_client().bucket(
+        bucket_name=os.getenv("AUTO_UPLOADED_IMAGES_BUCKET")
     )
+
+
+def reset_storage_client():
+    get_bucket.cache_clear()
+    get_storage_client.cache_clear()
+
+
+# the connections of the parent's HTTP session must not be shared with forked
+# processes, e.g. the celery prefork worker processes
+os.register_at_fork(after_in_child=reset_storage_client)
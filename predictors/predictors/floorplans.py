@@ -1,3 +1,5 @@
+import os
+from distutils.util import strtobool
 from typing import Dict, List, Optional, Tuple
 
 import numpy as np
@@ -13,14 +15,48 @@ def get_models() -> Dict[str, BasePredictor]:
     from predictors.predictors.icons import IconPredictor
     from predictors.predictors.roi import RoiPredictor
     from predictors.predictors.spaces import SpacePredictor
+    from predictors.predictors.utils.detectron import TiledPredictor
     from predictors.predictors.walls import WallPredictor
 
+    quantized = bool(strtobool(os.environ.get("PREDICTORS_QUANTIZED", "False")))
+    skip_empty_tiles = bool(
+        strtobool(os.environ.get("PREDICTORS_SKIP_EMPTY_TILES", "True"))
+    )
+    detectron_tile_batch_size = int(
+        os.environ.get("DETECTRON_TILE_BATCH_SIZE", TiledPredictor.TILE_BATCH_SIZE)
+    )
     return {
         "roi": RoiPredictor(),
-        "icons_v1": IconPredictor(version=1),
-        "icons_v2": IconPredictor(version=2),
-        "walls": WallPredictor(),
-        "spaces": SpacePredictor(),
+        "icons_v1": IconPredictor(
+            version=1,
+            quantized=quantized,
+            tile_batch_size=detectron_tile_batch_size,
+            skip_empty_tiles=skip_empty_tiles,
+        ),
+        "icons_v2": IconPredictor(
+            version=2,
+            quantized=quantized,
+            tile_batch_size=detectron_tile_batch_size,
+            skip_empty_tiles=skip_empty_tiles,
+        ),
+        "walls": WallPredictor(
+            tile_batch_size=int(
+                os.environ.get("WALLS_TILE_BATCH_SIZE", WallPredictor.TILE_BATCH_SIZE)
+            ),
+            accumulator_mode=os.environ.get("WALLS_ACCUMULATOR_MODE"),
+            backend=os.environ.get("WALLS_INFERENCE_BACKEND"),
+            num_threads=int(os.environ.get("WALLS_INFERENCE_THREADS", 0)),
+            quantized=quantized,
+            postprocessing_workers=int(
+                os.environ.get("WALLS_POSTPROCESSING_WORKERS", 0)
+            ),
+            skip_empty_tiles=skip_empty_tiles,
+        ),
+        "spaces": SpacePredictor(
+            quantized=quantized,
+            tile_batch_size=detectron_tile_batch_size,
+            skip_empty_tiles=skip_empty_tiles,
+        ),
     }
 
 
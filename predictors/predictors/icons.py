@@ -1,4 +1,5 @@
 from collections import defaultdict
+from typing import Optional
 
 import torch
 from detectron2 import model_zoo
@@ -8,6 +9,7 @@ from predictors.predictors.base import BasePredictor, MultiClassPrediction
 from predictors.predictors.constants import ClassLabel
 from predictors.predictors.utils.detectron import TiledPredictor
 from predictors.predictors.utils.geometry import mask_to_shape
+from predictors.predictors.utils.quantization import quantize_detectron_model
 
 
 class IconModelConfig:
@@ -69,17 +71,27 @@ MODEL_CONFIG = {
 
 
 class IconPredictor(BasePredictor):
-    def __init__(self, version: int):
+    def __init__(
+        self,
+        version: int,
+        quantized: bool = False,
+        tile_batch_size: Optional[int] = None,
+        skip_empty_tiles: Optional[bool] = None,
+    ):
         self.icon_model_config = MODEL_CONFIG[version]
         self.predictor = TiledPredictor(
-            self.detectron_cfg(self.icon_model_config),
+            self.detectron_cfg(self.icon_model_config, quantized=quantized),
             max_instance_size=self.icon_model_config.max_instance_size,
             merge_threshold=self.icon_model_config.merge_threshold,
             tile_size=self.icon_model_config.tile_size,
+            tile_batch_size=tile_batch_size,
+            skip_empty_tiles=skip_empty_tiles,
         )
+        if quantized:
+            self.predictor.model = quantize_detectron_model(self.predictor.model)
 
     @staticmethod
-    def detectron_cfg(icon_model_config):
+    def detectron_cfg(icon_model_config, quantized: bool = False):
         from predictors.tasks.utils.logging import logger
 
         cfg = get_cfg()
@@ -94,9 +106,14 @@ class IconPredictor(BasePredictor):
             icon_model_config.confidence_thresholds[label]
             for label in icon_model_config.class_labels
         )
-        cfg.MODEL.DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
+        cfg.MODEL.DEVICE = (
+            "cuda:0" if torch.cuda.is_available() and not quantized else "cpu"
+        )
 
-        logger.info(f"IconPredictor using device {cfg.MODEL.DEVICE}")
+        logger.info(
+            f"IconPredictor using device {cfg.MODEL.DEVICE}"
+            f"{' (quantized)' if quantized else ''}"
+        )
         return cfg
 
     def index_to_label(self, label_index) -> ClassLabel:
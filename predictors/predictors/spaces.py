@@ -1,3 +1,5 @@
+from typing import Optional
+
 from detectron2 import model_zoo
 from detectron2.config import get_cfg
 
@@ -5,21 +7,34 @@ from predictors.predictors.base import BasePredictor, MultiClassPrediction
 from predictors.predictors.constants import ClassLabel
 from predictors.predictors.utils.detectron import TiledPredictor
 from predictors.predictors.utils.geometry import mask_to_shape
+from predictors.predictors.utils.quantization import quantize_detectron_model
 
 
 class SpacePredictor(BasePredictor):
     BUFFER_PX = 40
     UNBUFFER_PX = 30
 
-    def __init__(self):
+    def __init__(
+        self,
+        quantized: bool = False,
+        tile_batch_size: Optional[int] = None,
+        skip_empty_tiles: Optional[bool] = None,
+    ):
         # NOTE: For foreground prediction getting the instances correct doesn't matter
         # as we are union-ing all spaces later anyway
         self.predictor = TiledPredictor(
-            self.config(), max_instance_size=100, merge_threshold=0.1, tile_size=1024
+            self.config(quantized=quantized),
+            max_instance_size=100,
+            merge_threshold=0.1,
+            tile_size=1024,
+            tile_batch_size=tile_batch_size,
+            skip_empty_tiles=skip_empty_tiles,
         )
+        if quantized:
+            self.predictor.model = quantize_detectron_model(self.predictor.model)
 
     @staticmethod
-    def config():
+    def config(quantized: bool = False):
         import torch
 
         from predictors.tasks.utils.logging import logger
@@ -33,8 +48,13 @@ class SpacePredictor(BasePredictor):
         cfg.MODEL.ROI_HEADS.NUM_CLASSES = 11
         cfg.MODEL.WEIGHTS = "resources/spaces_model_final.pth"
         cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5
-        cfg.MODEL.DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
-        logger.info(f"SpacePredictor using device {cfg.MODEL.DEVICE}")
+        cfg.MODEL.DEVICE = (
+            "cuda:0" if torch.cuda.is_available() and not quantized else "cpu"
+        )
+        logger.info(
+            f"SpacePredictor using device {cfg.MODEL.DEVICE}"
+            f"{' (quantized)' if quantized else ''}"
+        )
         return cfg
 
     def predict(self, image) -> MultiClassPrediction:
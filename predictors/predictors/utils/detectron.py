@@ -1,22 +1,50 @@
 import math
-from itertools import product
+from itertools import groupby, product
 
 import cv2
 import numpy as np
+import torch
 from detectron2.engine import DefaultPredictor
 from detectron2.structures import Boxes, Instances
 from shapely.geometry import box
 
+from predictors.predictors.utils.masks import (
+    CroppedMask,
+    cropped_masks_array,
+    group_overlapping_masks,
+)
+from predictors.predictors.utils.tiling import EmptyTileScreen, batched
+
+
+def _tile_shape(tile):
+    return tile[2].shape[:2]
+
 
 class TiledPredictor(DefaultPredictor):
-    def __init__(self, cfg, tile_size, max_instance_size, merge_threshold):
+    TILE_BATCH_SIZE = 4
+    SKIP_EMPTY_TILES = True
+
+    def __init__(
+        self,
+        cfg,
+        tile_size,
+        max_instance_size,
+        merge_threshold,
+        tile_batch_size=None,
+        skip_empty_tiles=None,
+    ):
         self.max_instance_size = max_instance_size
         self.tile_size = tile_size
         self.stride = self.tile_size - self.max_instance_size
         self.merge_threshold = merge_threshold
+        self.tile_batch_size = tile_batch_size or self.TILE_BATCH_SIZE
+        self.skip_empty_tiles = (
+            self.SKIP_EMPTY_TILES if skip_empty_tiles is None else skip_empty_tiles
+        )
         assert self.stride >= self.max_instance_size
 
         super().__init__(cfg)
+        self._transforms = {}
 
     def _get_tile_slices(self, tile, shape):
         height, width = shape[:2]
@@ -28,25 +56,72 @@ class TiledPredictor(DefaultPredictor):
         return slice(from_row, to_row), slice(from_col, to_col)
 
     def _tile_image(self, image):
+        """Tiles without ink are skipped, they can't contain any instance"""
+        from predictors.tasks.utils.metrics import record_metric
+
         height, width = image.shape[:2]
         rows, cols = math.ceil(height / self.stride), math.ceil(width / self.stride)
-        return [
-            (row, col, image[self._get_tile_slices(tile=(row, col), shape=image.shape)])
-            for row, col in product(range(rows), range(cols))
-        ]
+        screen = EmptyTileScreen(image) if self.skip_empty_tiles else None
+        tiles = []
+        for row, col in product(range(rows), range(cols)):
+            row_slice, col_slice = self._get_tile_slices(
+                tile=(row, col), shape=image.shape[:2]
+            )
+            if screen and screen.is_empty(
+                row_slice.start, col_slice.start, row_slice.stop, col_slice.stop
+            ):
+                continue
+            tiles.append((row, col, image[row_slice, col_slice]))
+        if screen:
+            record_metric("detectron_empty_tile_skip_rate", screen.skip_rate)
+        return tiles
+
+    def _get_transform(self, shape):
+        """The resize transform only depends on the tile shape, all tiles but the
+        ones at the bottom and right image borders share it"""
+        if shape not in self._transforms:
+            self._transforms[shape] = self.aug.get_transform(
+                np.empty(shape, dtype=np.uint8)
+            )
+        return self._transforms[shape]
+
+    def _preprocess_tile(self, image_tile):
+        """Same as the preprocessing of DefaultPredictor.__call__"""
+        if self.input_format == "RGB":
+            image_tile = image_tile[:, :, ::-1]
+        height, width = image_tile.shape[:2]
+        image = self._get_transform(image_tile.shape).apply_image(image_tile)
+        return {
+            "image": torch.as_tensor(image.astype("float32").transpose(2, 0, 1)),
+            "height": height,
+            "width": width,
+        }
+
+    def _get_tiled_batches(self, image):
+        """Batches of tiles of the same shape. The model pads the images of a batch
+        to the largest one with zeros, i.e. black ink, so smaller border tiles must
+        not share a batch with larger tiles."""
+        tiles = sorted(self._tile_image(image=image), key=_tile_shape)
+        for _, shape_tiles in groupby(tiles, key=_tile_shape):
+            yield from batched(shape_tiles, self.tile_batch_size)
 
     def _get_tiled_instances(self, image):
-        for row, col, image_tile in self._tile_image(image=image):
-            instances = super().__call__(image_tile)["instances"].to("cpu")
-            if instances.pred_masks.any():
-                yield row, col, list(
-                    zip(
-                        instances.pred_masks,
-                        instances.pred_boxes,
-                        instances.pred_classes,
-                        instances.scores,
-                    )
+        for batch in self._get_tiled_batches(image=image):
+            with torch.inference_mode():
+                predictions = self.model(
+                    [self._preprocess_tile(image_tile) for _, _, image_tile in batch]
                 )
+            for (row, col, _), prediction in zip(batch, predictions):
+                instances = prediction["instances"].to("cpu")
+                if instances.pred_masks.any():
+                    yield row, col, list(
+                        zip(
+                            instances.pred_masks,
+                            instances.pred_boxes,
+                            instances.pred_classes,
+                            instances.scores,
+                        )
+                    )
 
     @staticmethod
     def _filter_instances(tiled_instances):
@@ -74,10 +149,11 @@ class TiledPredictor(DefaultPredictor):
         untiled_instances = []
         for row, col, instances in tiled_instances:
             for pred_mask, pred_box, pred_class, score in instances:
-                untiled_mask = np.zeros(image_shape[:2], dtype=bool)
-                untiled_mask[
-                    self._get_tile_slices(tile=(row, col), shape=image_shape[:2])
-                ] = pred_mask
+                untiled_mask = CroppedMask.from_mask(
+                    pred_mask.numpy(),
+                    offset=(row * self.stride, col * self.stride),
+                    shape=image_shape[:2],
+                )
                 untiled_bbox = [
                     pred_box[0] + col * self.stride,
                     pred_box[1] + row * self.stride,
@@ -89,43 +165,21 @@ class TiledPredictor(DefaultPredictor):
                 )
         return untiled_instances
 
-    @staticmethod
-    def _intersection_ij(pred_mask_i, pred_mask_j):
-        return 1 - (np.sum(pred_mask_i + pred_mask_j) - np.sum(pred_mask_i)) / np.sum(
-            pred_mask_j
-        )
-
-    def _get_instances_to_merge(self, instances):
-        masks_and_classes = [(mask, class_) for mask, _, class_, _ in instances]
-        return [
-            (i, j)
-            for i, j, intersection in sorted(
-                [
-                    (i, j, self._intersection_ij(mask_i, mask_j))
-                    for i, (mask_i, class_i) in enumerate(masks_and_classes)
-                    for j, (mask_j, class_j) in enumerate(masks_and_classes)
-                    if i != j and class_i == class_j
-                ],
-                key=lambda iji: iji[2],
-                reverse=True,
-            )
-            if intersection > self.merge_threshold
-        ]
-
     def _merge_instances(self, instances: list):
-        instances_to_merge = self._get_instances_to_merge(instances)
+        """Merges the instances of the same class transitively connected by a mask
+        overlap above the merge threshold into the first instance of each group"""
         merged_instances = []
-        while instances_to_merge:
-            i, j = instances_to_merge[0]
-            mask, bbox, class_, score = instances[i]
-            mask += instances[j][0]
-            bbox = box(*instances[j][1]).union(box(*bbox)).bounds
-            instances[i] = mask, bbox, class_, score
-            instances_to_merge = [ij for ij in instances_to_merge if j not in ij]
-            merged_instances.append(j)
-        for i in sorted(merged_instances, reverse=True):
-            del instances[i]
-        return instances
+        for group in group_overlapping_masks(
+            masks=[mask for mask, _, _, _ in instances],
+            labels=[int(class_) for _, _, class_, _ in instances],
+            threshold=self.merge_threshold,
+        ):
+            mask, bbox, class_, score = instances[group[0]]
+            for j in group[1:]:
+                mask = mask.union(instances[j][0])
+                bbox = box(*instances[j][1]).union(box(*bbox)).bounds
+            merged_instances.append((mask, bbox, class_, score))
+        return merged_instances
 
     def _predict(self, image):
         merged_instances = self._merge_instances(
@@ -137,8 +191,12 @@ class TiledPredictor(DefaultPredictor):
             )
         )
 
-        pred_masks, pred_boxes, pred_classes, scores = map(
-            np.array, zip(*merged_instances) if merged_instances else [[]] * 4
+        pred_masks, pred_boxes, pred_classes, scores = (
+            zip(*merged_instances) if merged_instances else [[]] * 4
+        )
+        pred_masks = cropped_masks_array(pred_masks)
+        pred_boxes, pred_classes, scores = map(
+            np.array, (pred_boxes, pred_classes, scores)
         )
 
         image_instances = Instances(image_size=image.shape[:2])
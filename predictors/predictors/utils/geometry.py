@@ -4,6 +4,7 @@ from operator import itemgetter
 from typing import List, Tuple, Union
 
 import numpy as np
+import shapely
 from numpy import array, dot, ndarray
 from numpy.linalg import linalg
 from shapely.affinity import rotate, translate
@@ -302,6 +303,63 @@ def get_center_line_from_rectangle(
     )
 
 
+def get_center_lines_from_rectangles(
+    rectangles: ndarray,
+) -> Tuple[ndarray, ndarray]:
+    """Vectorized get_center_line_from_rectangle(only_longest=False) of an array of
+    rectangle polygons.
+
+    Returns the long and the short center lines of each rectangle as (N, 2, 2)
+    arrays of start and end points.
+    """
+    coords = shapely.get_coordinates(shapely.get_exterior_ring(rectangles)).reshape(
+        len(rectangles), 5, 2
+    )
+    # counter-clockwise like orient(polygon)
+    x, y = coords[:, :, 0], coords[:, :, 1]
+    is_clockwise = np.sum(x[:, :-1] * y[:, 1:] - x[:, 1:] * y[:, :-1], axis=1) < 0
+    coords = np.where(is_clockwise[:, None, None], coords[:, ::-1], coords)
+
+    sides = coords[:, 1:] - coords[:, :-1]
+    midpoints = (coords[:, 1:] + coords[:, :-1]) / 2
+    lengths = np.sqrt(sides[:, :, 0] ** 2 + sides[:, :, 1] ** 2)
+    sides_by_length = np.argsort(lengths, axis=1, kind="stable")
+    rows = np.arange(len(rectangles))[:, None]
+
+    unit_sides = sides / lengths[:, :, None]
+    parallelism = np.abs(
+        np.round(
+            np.sum(
+                unit_sides[rows, sides_by_length[:, :1]]
+                * unit_sides[rows, sides_by_length[:, 1:]],
+                axis=2,
+            ),
+            6,
+        )
+    )
+    other_sides = np.take_along_axis(
+        sides_by_length[:, 1:],
+        np.argsort(-parallelism, axis=1, kind="stable"),
+        axis=1,
+    )
+
+    long_lines = np.stack(
+        [
+            midpoints[rows[:, 0], sides_by_length[:, 0]],
+            midpoints[rows[:, 0], other_sides[:, 0]],
+        ],
+        axis=1,
+    )
+    short_lines = np.stack(
+        [
+            midpoints[rows[:, 0], other_sides[:, 1]],
+            midpoints[rows[:, 0], other_sides[:, 2]],
+        ],
+        axis=1,
+    )
+    return long_lines, short_lines
+
+
 def dot_product_normalised_linestrings(
     line_a: LineString, line_b: LineString
 ) -> Union[ndarray, float]:
@@ -332,15 +390,87 @@ def dot_product_normalised_linestrings(
     )  # rounding is necessary to avoid values below and above 1
 
 
+def get_segment_intersections(
+    segments: ndarray, extension: float = 0.0, chunk_size: int = 1024
+) -> ndarray:
+    """Intersection points of all pairs of line segments.
+
+    segments: (N, 2, 2) array of segment start and end points
+    extension: each segment is extended by this length (half of it at each end)
+        before intersecting, like shapely's scale by 1 + extension / length
+    chunk_size: number of segments intersected with all the others at once, bounds
+        the memory to chunk_size x N pairs
+
+    Returns the (M, 2) intersection points ordered by pair (i, j) with i < j, parallel
+    segments are never intersecting.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2, 2)
+    # same arithmetic as shapely's scale about the center, so that segments touching
+    # at their extended ends are intersected identically
+    midpoints = (segments.min(axis=1) + segments.max(axis=1)) / 2
+    factors = 1 + extension / np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1)
+    segments = (
+        segments * factors[:, None, None]
+        + (midpoints - midpoints * factors[:, None])[:, None]
+    )
+    starts, ends = segments[:, 0], segments[:, 1]
+    directions = ends - starts
+    indices = np.arange(len(segments))
+
+    intersections = []
+    for chunk_start in range(0, len(segments), chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        p, p_end, r = starts[chunk, None], ends[chunk, None], directions[chunk, None]
+        q, q_end, s = starts[None], ends[None], directions[None]
+        # the segments intersect if the end points of each one are not on the same
+        # side of the other one, orientation tests are robust at the segment ends
+        i, j = np.nonzero(
+            (np.sign(np.cross(r, q - p)) * np.sign(np.cross(r, q_end - p)) <= 0)
+            & (np.sign(np.cross(s, p - q)) * np.sign(np.cross(s, p_end - q)) <= 0)
+            & (np.cross(r, s) != 0)
+            & (indices[None] > indices[chunk, None])
+        )
+        p, r = starts[chunk][i], directions[chunk][i]
+        q, s = starts[j], directions[j]
+        t = np.cross(q - p, s) / np.cross(r, s)
+        intersections.append(p + t[:, None] * r)
+
+    if not intersections:
+        return np.empty((0, 2))
+    return np.concatenate(intersections)
+
+
 def mask_to_shape(mask):
-    """ATTENTION this closes holes!"""
-    from skimage import measure
+    """ATTENTION this closes holes!
+
+    Accepts dense masks and CroppedMasks, the outer contours are traced only within
+    the bounding box of the mask, the polygons' vertices are the centers of the
+    mask's boundary pixels.
+    """
+    import cv2
+
+    from predictors.predictors.utils.masks import CroppedMask
 
+    if not isinstance(mask, CroppedMask):
+        mask = CroppedMask.from_mask(mask)
+    if not mask.any():
+        return Polygon()
+
+    row, column = mask.offset
+    contours, _ = cv2.findContours(
+        np.ascontiguousarray(mask.mask, dtype=np.uint8),
+        cv2.RETR_EXTERNAL,
+        cv2.CHAIN_APPROX_SIMPLE,
+        offset=(int(column), int(row)),
+    )
+    # contours of 8-connected pixels touch themselves at diagonal connections and
+    # along one pixel wide lines, buffering repairs them to their covered area
     mask_shape = unary_union(
         [
-            pol
-            for c in measure.find_contours(mask, 0.99)
-            if (pol := Polygon(np.round(np.flip(c, axis=1)))).is_valid
+            pol if pol.is_valid else pol.buffer(0)
+            for contour in contours
+            if len(contour) > 2
+            for pol in [Polygon(contour[:, 0, :])]
         ]
     )
     if mask_shape.is_empty:
@@ -0,0 +1,120 @@
+from pathlib import Path
+from typing import Dict, Optional, Type
+
+import numpy as np
+import torch
+
+
+class InferenceBackend:
+    """Executes a segmentation model on a preprocessed (N, 3, width, height) batch
+    and returns the (N, classes, width, height) predictions as numpy array
+    """
+
+    MODEL_SUFFIX: str
+
+    def __init__(self, model_path: Path, device: str, num_threads: Optional[int]):
+        raise NotImplementedError
+
+    def __call__(self, x_tensor: torch.Tensor) -> np.ndarray:
+        raise NotImplementedError
+
+
+class TorchBackend(InferenceBackend):
+    """Eager execution of the pickled torch module"""
+
+    MODEL_SUFFIX = ".pth"
+
+    def __init__(self, model_path: Path, device: str, num_threads: Optional[int]):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = torch.load(model_path, map_location=torch.device(device))
+
+    def __call__(self, x_tensor: torch.Tensor) -> np.ndarray:
+        with torch.inference_mode():
+            return self.model(x_tensor).cpu().numpy()
+
+
+class TorchScriptBackend(TorchBackend):
+    """Execution of a traced TorchScript graph, frozen for inference"""
+
+    MODEL_SUFFIX = ".pt"
+
+    def __init__(self, model_path: Path, device: str, num_threads: Optional[int]):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = torch.jit.optimize_for_inference(
+            torch.jit.freeze(
+                torch.jit.load(model_path, map_location=torch.device(device)).eval()
+            )
+        )
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """Execution of the exported ONNX graph with ONNX Runtime"""
+
+    MODEL_SUFFIX = ".onnx"
+
+    def __init__(self, model_path: Path, device: str, num_threads: Optional[int]):
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+
+        providers = ["CPUExecutionProvider"]
+        if device.startswith("cuda"):
+            providers.insert(0, "CUDAExecutionProvider")
+
+        self.session = onnxruntime.InferenceSession(
+            Path(model_path).as_posix(),
+            sess_options=session_options,
+            providers=providers,
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x_tensor: torch.Tensor) -> np.ndarray:
+        (prediction,) = self.session.run(
+            None, {self.input_name: x_tensor.cpu().numpy()}
+        )
+        return prediction
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    "torch": TorchBackend,
+    "torchscript": TorchScriptBackend,
+    "onnx": OnnxRuntimeBackend,
+}
+
+
+def get_backend(
+    name: str, model_path: Path, device: str, num_threads: Optional[int] = None
+) -> InferenceBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"backend must be one of {set(BACKENDS)}, got {name}.")
+    return BACKENDS[name](model_path=model_path, device=device, num_threads=num_threads)
+
+
+def export_torchscript(model: torch.nn.Module, output_path: Path, tile_size: int):
+    example_input = torch.rand(1, 3, tile_size, tile_size)
+    with torch.no_grad():
+        traced_model = torch.jit.trace(model.eval(), example_input)
+    torch.jit.save(traced_model, Path(output_path).as_posix())
+
+
+def export_onnx(
+    model: torch.nn.Module, output_path: Path, tile_size: int, opset_version: int = 13
+):
+    example_input = torch.rand(1, 3, tile_size, tile_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(),
+            example_input,
+            Path(output_path).as_posix(),
+            input_names=["image"],
+            output_names=["mask"],
+            dynamic_axes={"image": {0: "batch"}, "mask": {0: "batch"}},
+            opset_version=opset_version,
+        )
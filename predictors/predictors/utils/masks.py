@@ -0,0 +1,165 @@
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class CroppedMask:
+    """Boolean instance mask of an image stored as the crop of its bounding box
+    and the (row, column) offset of the crop in the image.
+
+    The dense mask is only materialized when the mask is converted to an array
+    or indexed, so the memory of an instance scales with its size and not with
+    the size of the image.
+    """
+
+    def __init__(
+        self, mask: np.ndarray, offset: Tuple[int, int], shape: Tuple[int, int]
+    ):
+        self.mask = mask
+        self.offset = offset
+        self.shape = shape
+
+    @classmethod
+    def from_mask(
+        cls,
+        mask: np.ndarray,
+        offset: Tuple[int, int] = (0, 0),
+        shape: Optional[Tuple[int, int]] = None,
+    ) -> "CroppedMask":
+        """Crops the given mask, located at offset in an image of the given shape,
+        to the bounding box of its foreground"""
+        mask = np.asarray(mask, dtype=bool)
+        shape = tuple(shape or mask.shape)
+        (rows,) = np.nonzero(mask.any(axis=1))
+        (columns,) = np.nonzero(mask.any(axis=0))
+        if not len(rows):
+            return cls(np.zeros((0, 0), dtype=bool), offset=(0, 0), shape=shape)
+        return cls(
+            np.ascontiguousarray(
+                mask[rows[0] : rows[-1] + 1, columns[0] : columns[-1] + 1]
+            ),
+            offset=(offset[0] + int(rows[0]), offset[1] + int(columns[0])),
+            shape=shape,
+        )
+
+    @property
+    def bounds(self) -> Tuple[int, int, int, int]:
+        """min_row, min_column, max_row, max_column (exclusive) of the crop"""
+        row, column = self.offset
+        return row, column, row + self.mask.shape[0], column + self.mask.shape[1]
+
+    def area(self) -> int:
+        return int(np.count_nonzero(self.mask))
+
+    def any(self) -> bool:
+        return bool(self.mask.any())
+
+    def _window(self, bounds):
+        min_row, min_column, max_row, max_column = bounds
+        row, column = self.offset
+        return self.mask[
+            min_row - row : max_row - row, min_column - column : max_column - column
+        ]
+
+    def intersection_area(self, other: "CroppedMask") -> int:
+        min_row, min_column, max_row, max_column = self.bounds
+        other_min_row, other_min_column, other_max_row, other_max_column = other.bounds
+        bounds = (
+            max(min_row, other_min_row),
+            max(min_column, other_min_column),
+            min(max_row, other_max_row),
+            min(max_column, other_max_column),
+        )
+        if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+            return 0
+        return int(np.count_nonzero(self._window(bounds) & other._window(bounds)))
+
+    def union(self, other: "CroppedMask") -> "CroppedMask":
+        if not other.mask.size:
+            return self
+        if not self.mask.size:
+            return other
+        min_row, min_column, max_row, max_column = self.bounds
+        other_min_row, other_min_column, other_max_row, other_max_column = other.bounds
+        min_row, min_column = min(min_row, other_min_row), min(
+            min_column, other_min_column
+        )
+        mask = np.zeros(
+            (
+                max(max_row, other_max_row) - min_row,
+                max(max_column, other_max_column) - min_column,
+            ),
+            dtype=bool,
+        )
+        for cropped_mask in (self, other):
+            row, column = cropped_mask.offset
+            mask[
+                row - min_row : row - min_row + cropped_mask.mask.shape[0],
+                column - min_column : column - min_column + cropped_mask.mask.shape[1],
+            ] |= cropped_mask.mask
+        return CroppedMask(mask, offset=(min_row, min_column), shape=self.shape)
+
+    def __array__(self, dtype=None):
+        mask = np.zeros(self.shape, dtype=bool)
+        min_row, min_column, max_row, max_column = self.bounds
+        mask[min_row:max_row, min_column:max_column] = self.mask
+        return mask if dtype is None else mask.astype(dtype)
+
+    def __getitem__(self, key):
+        return np.asarray(self)[key]
+
+
+def cropped_masks_array(masks) -> np.ndarray:
+    """1D object array of the masks, numpy would otherwise densify them"""
+    masks = list(masks)
+    array = np.empty(len(masks), dtype=object)
+    for i, mask in enumerate(masks):
+        array[i] = mask
+    return array
+
+
+def get_overlapping_pairs(
+    masks: Sequence[CroppedMask], labels: Sequence[int]
+) -> Iterator[Tuple[int, int]]:
+    """Sort and sweep over the rows of the masks' bounding boxes, yields the index
+    pairs (i < j) of masks with the same label whose bounding boxes overlap"""
+    bounds = [mask.bounds for mask in masks]
+    active: List[int] = []
+    for i in sorted(range(len(masks)), key=lambda i: bounds[i][0]):
+        min_row, min_column, _, max_column = bounds[i]
+        active = [j for j in active if bounds[j][2] > min_row]
+        for j in active:
+            if (
+                labels[i] == labels[j]
+                and bounds[j][1] < max_column
+                and min_column < bounds[j][3]
+            ):
+                yield min(i, j), max(i, j)
+        active.append(i)
+
+
+def group_overlapping_masks(
+    masks: Sequence[CroppedMask], labels: Sequence[int], threshold: float
+) -> List[List[int]]:
+    """Groups the masks transitively connected by an overlap of more than threshold
+    of the smaller mask's area, the groups and their indices are sorted ascending"""
+    parents = list(range(len(masks)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    areas = [mask.area() for mask in masks]
+    for i, j in get_overlapping_pairs(masks, labels):
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j or not min(areas[i], areas[j]):
+            continue
+        if masks[i].intersection_area(masks[j]) > threshold * min(areas[i], areas[j]):
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(masks)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
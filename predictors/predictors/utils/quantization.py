@@ -0,0 +1,88 @@
+import copy
+import inspect
+from typing import Iterable
+
+import torch
+
+QUANTIZATION_ENGINE = "fbgemm"
+
+
+class ResNetDeepLabV3Plus(torch.nn.Module):
+    """Symbolically traceable forward of a segmentation_models_pytorch DeepLabV3+
+    with ResNet encoder. The encoder's own forward creates its stages on every call,
+    which torch.fx can't trace, so the stages are unrolled here instead.
+    """
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.encoder = model.encoder
+        self.decoder = model.decoder
+        self.segmentation_head = model.segmentation_head
+
+    def forward(self, x):
+        encoder = self.encoder
+        features = [x]
+        x = encoder.relu(encoder.bn1(encoder.conv1(x)))
+        features.append(x)
+        x = encoder.layer1(encoder.maxpool(x))
+        features.append(x)
+        x = encoder.layer2(x)
+        features.append(x)
+        x = encoder.layer3(x)
+        features.append(x)
+        x = encoder.layer4(x)
+        features.append(x)
+        return self.segmentation_head(self.decoder(*features))
+
+
+def quantize_walls_model(
+    model: torch.nn.Module, calibration_batches: Iterable[torch.Tensor]
+) -> torch.jit.ScriptModule:
+    """Post-training static INT8 quantization (FX graph mode) of the walls model.
+
+    The activation ranges are calibrated on the given preprocessed (N, 3, width, height)
+    batches, the quantized model is returned as traced TorchScript graph that can be
+    run by the torchscript inference backend. The given model isn't modified.
+    """
+    from torch.quantization import get_default_qconfig
+    from torch.quantization.quantize_fx import convert_fx, prepare_fx
+
+    calibration_batches = iter(calibration_batches)
+    example_batch = next(calibration_batches, None)
+    if example_batch is None:
+        raise ValueError("At least one calibration batch is required.")
+    example_batch = example_batch.cpu()
+
+    torch.backends.quantized.engine = QUANTIZATION_ENGINE
+    prepare_kwargs = {}
+    if "example_inputs" in inspect.signature(prepare_fx).parameters:
+        # required since torch 1.13
+        prepare_kwargs["example_inputs"] = (example_batch,)
+    prepared_model = prepare_fx(
+        ResNetDeepLabV3Plus(copy.deepcopy(model).cpu()).eval(),
+        {"": get_default_qconfig(QUANTIZATION_ENGINE)},
+        **prepare_kwargs,
+    )
+
+    with torch.inference_mode():
+        prepared_model(example_batch)
+        for batch in calibration_batches:
+            prepared_model(batch.cpu())
+
+    quantized_model = convert_fx(prepared_model)
+    with torch.no_grad():
+        return torch.jit.trace(quantized_model, example_batch)
+
+
+def quantize_detectron_model(model: torch.nn.Module) -> torch.nn.Module:
+    """Post-training dynamic INT8 quantization of a detectron2 model.
+
+    Only the linear layers (the box head and predictors of the Mask R-CNN) are
+    quantized, their weights are converted once when the model is loaded and the
+    activations are quantized on the fly, hence no calibration is needed.
+    Dynamic quantization is only supported on CPU.
+    """
+    torch.backends.quantized.engine = QUANTIZATION_ENGINE
+    return torch.quantization.quantize_dynamic(
+        model.cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
@@ -1,5 +1,18 @@
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Tuple, TypeVar
+
+import cv2
 import numpy as np
 
+T = TypeVar("T")
+
+
+def batched(iterable: Iterable[T], n: int) -> Iterator[Tuple[T, ...]]:
+    """Batches the iterable into tuples of length n, the last one may be shorter"""
+    iterator = iter(iterable)
+    while batch := tuple(islice(iterator, n)):
+        yield batch
+
 
 def get_image_tile_bounds(width: int, height: int, tile_size: int, tile_stride: float):
     N, M = int(np.ceil(width / tile_stride)), int(np.ceil(height / tile_stride))
@@ -24,7 +37,7 @@ def pad_image_if_needed(
     pad_y = max(min_height, height) - height
 
     if pad_x > 0 or pad_y > 0:
-        result = np.full((width + pad_x, height + pad_y, 3), color)
+        result = np.full((width + pad_x, height + pad_y, 3), color, dtype=image.dtype)
         result[
             pad_x // 2 : pad_x // 2 + width, pad_y // 2 : pad_y // 2 + height, :
         ] = image
@@ -44,3 +57,157 @@ def unpad_image_if_needed(
         pad_x // 2 : pad_x // 2 + original_width,
         pad_y // 2 : pad_y // 2 + original_height,
     ]
+
+
+class TileMaskAccumulator:
+    """Merges the tile predictions of a segmentation model into a class-first
+    (classes, width, height) probability mask.
+
+    The mask is stored as float16 (or uint8) instead of float64 and tiles are
+    written in place, so apart from the output itself only tile-sized temporaries
+    are allocated. Modes to resolve the overlap between tiles:
+        - window: every tile only writes the part it owns, i.e. its bounds shrunk
+                  by half the actual overlap with its neighbouring tiles. A tile
+                  cut off by the image border can overlap the previous tile by more
+                  than tile_overlap, a tile inside the previous one owns nothing.
+        - blend: overlapping predictions are averaged, weighted by a linear ramp
+                 towards the tile borders
+        - max: the maximum probability of all overlapping tiles is kept
+    """
+
+    MODES = ("window", "blend", "max")
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        classes: int,
+        tile_size: int,
+        tile_overlap: int,
+        mode: str = "window",
+        dtype=np.float16,
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, got {mode}.")
+
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.tile_stride = tile_size - tile_overlap
+        self.tile_overlap = tile_overlap
+        self.mode = mode
+        self.dtype = np.dtype(dtype)
+        self.mask = np.zeros((classes, width, height), dtype=self.dtype)
+        self.weights = (
+            np.zeros((width, height), dtype=np.float32) if mode == "blend" else None
+        )
+
+    def _to_storage(self, probabilities: np.ndarray) -> np.ndarray:
+        if self.dtype == np.uint8:
+            return np.rint(np.clip(probabilities, 0, 1) * 255).astype(np.uint8)
+        return probabilities.astype(self.dtype, copy=False)
+
+    def _from_storage(self, stored: np.ndarray) -> np.ndarray:
+        if self.dtype == np.uint8:
+            return stored.astype(np.float32) / 255
+        return stored.astype(np.float32)
+
+    def _owned_interval(self, start: int, end: int, size: int) -> Tuple[int, int]:
+        """The part of the tile interval on an axis of the tile grid of
+        get_image_tile_bounds which isn't owned by the previous or next tile"""
+        owned_start, owned_end = start, end
+        if start > 0:
+            previous_end = min(start - self.tile_stride + self.tile_size, size)
+            owned_start = (start + previous_end) // 2 if previous_end < size else size
+        if end < size:
+            owned_end = (start + self.tile_stride + end) // 2
+        return owned_start, owned_end
+
+    def _owned_window(self, x1: int, y1: int, x2: int, y2: int):
+        wx1, wx2 = self._owned_interval(x1, x2, self.width)
+        wy1, wy2 = self._owned_interval(y1, y2, self.height)
+        return wx1, wy1, wx2, wy2
+
+    def _tile_weights(self, tile_width: int, tile_height: int) -> np.ndarray:
+        def ramp(n):
+            distance_to_border = np.minimum(np.arange(1, n + 1), np.arange(n, 0, -1))
+            return np.minimum(distance_to_border, max(self.tile_overlap, 1))
+
+        return np.outer(ramp(tile_width), ramp(tile_height)).astype(np.float32)
+
+    def add(self, x1: int, y1: int, x2: int, y2: int, tile_mask: np.ndarray):
+        """Adds the (classes, x2 - x1, y2 - y1) prediction of the tile with the given bounds"""
+        if self.mode == "window":
+            wx1, wy1, wx2, wy2 = self._owned_window(x1, y1, x2, y2)
+            self.mask[:, wx1:wx2, wy1:wy2] = self._to_storage(
+                tile_mask[:, wx1 - x1 : wx2 - x1, wy1 - y1 : wy2 - y1]
+            )
+        elif self.mode == "max":
+            region = self.mask[:, x1:x2, y1:y2]
+            np.maximum(region, self._to_storage(tile_mask), out=region)
+        else:
+            tile_weights = self._tile_weights(x2 - x1, y2 - y1)
+            previous_weights = self.weights[x1:x2, y1:y2]
+            total_weights = previous_weights + tile_weights
+            blended = (
+                self._from_storage(self.mask[:, x1:x2, y1:y2]) * previous_weights
+                + tile_mask * tile_weights
+            ) / total_weights
+            self.mask[:, x1:x2, y1:y2] = self._to_storage(blended)
+            self.weights[x1:x2, y1:y2] = total_weights
+
+    def result(self) -> np.ndarray:
+        """Returns the merged (classes, width, height) probabilities"""
+        if self.dtype == np.uint8:
+            return np.divide(self.mask, 255, dtype=np.float16)
+        return self.mask
+
+
+class EmptyTileScreen:
+    """Pre-screens the tiles of an image for ink, i.e. pixels darker than
+    ink_threshold (in the 0-255 range) in any channel, to skip the models on blank
+    paper. The ink pixels are counted with an integral image of the whole image,
+    so screening a tile is O(1). Tiles with at most max_ink_pixels are empty.
+    """
+
+    INK_THRESHOLD = 224
+    MAX_INK_PIXELS = 32
+
+    def __init__(
+        self,
+        image: np.ndarray,
+        ink_threshold: Optional[float] = None,
+        max_ink_pixels: Optional[int] = None,
+    ):
+        image = np.asarray(image)
+        ink_threshold = ink_threshold or self.INK_THRESHOLD
+        if not np.issubdtype(image.dtype, np.integer) and image.max() <= 1:
+            ink_threshold /= 255
+        self.max_ink_pixels = (
+            self.MAX_INK_PIXELS if max_ink_pixels is None else max_ink_pixels
+        )
+
+        if image.ndim == 3:
+            # much faster than image.min(axis=2) on interleaved channels
+            image = np.minimum.reduce([image[..., c] for c in range(image.shape[2])])
+        self.integral = cv2.integral((image < ink_threshold).view(np.uint8))
+        self.tiles = 0
+        self.empty_tiles = 0
+
+    def ink_pixels(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        """Number of ink pixels in image[x1:x2, y1:y2]"""
+        integral = self.integral
+        return int(
+            integral[x2, y2] - integral[x1, y2] - integral[x2, y1] + integral[x1, y1]
+        )
+
+    def is_empty(self, x1: int, y1: int, x2: int, y2: int) -> bool:
+        is_empty = self.ink_pixels(x1, y1, x2, y2) <= self.max_ink_pixels
+        self.tiles += 1
+        self.empty_tiles += is_empty
+        return is_empty
+
+    @property
+    def skip_rate(self) -> float:
+        """Share of the screened tiles that were empty"""
+        return self.empty_tiles / self.tiles if self.tiles else 0.0
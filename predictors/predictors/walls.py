@@ -1,34 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from itertools import chain
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import cv2
 import numpy as np
 import segmentation_models_pytorch as smp
+import shapely
 import torch
 from PIL import Image
+from scipy.ndimage import distance_transform_edt, map_coordinates
+from shapely import STRtree, buffer, linestrings, points
 from shapely.affinity import rotate, scale, translate
 from shapely.geometry import (
     CAP_STYLE,
     JOIN_STYLE,
     LineString,
     MultiLineString,
-    Point,
     Polygon,
     box,
 )
-from skimage.measure import profile_line
-from skimage.morphology import dilation, medial_axis, skeletonize, square
+from skimage.morphology import skeletonize
 from skimage.transform import probabilistic_hough_line
 
 from predictors.predictors.base import BasePredictor, MultiClassPrediction
 from predictors.predictors.constants import ClassLabel
 from predictors.predictors.utils.geometry import (
     get_center_line_from_rectangle,
+    get_center_lines_from_rectangles,
     get_polygons,
+    get_segment_intersections,
     mask_to_shape,
 )
+from predictors.predictors.utils.inference import BACKENDS, get_backend
 from predictors.predictors.utils.tiling import (
+    EmptyTileScreen,
+    TileMaskAccumulator,
+    batched,
     get_image_tile_bounds,
     pad_image_if_needed,
     unpad_image_if_needed,
@@ -58,85 +67,183 @@ class WallPredictor(BasePredictor):
         SegmentationLabel.DOORS,
     ]
     TILE_SIZE = 1024
+    TILE_OVERLAP = 128
+    TILE_BATCH_SIZE = 4
+    ACCUMULATOR_MODE = "window"
+    ACCUMULATOR_DTYPE = np.float16
+    SKIP_EMPTY_TILES = True
     ENCODER = "resnet101"
     ENCODER_WEIGHTS = "imagenet"
 
     TORCH_MODEL_PATH = Path("resources/walls_model_latest.pth")
+    QUANTIZED_MODEL_PATH = Path("resources/walls_model_latest_int8.pt")
     TORCH_DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
-
-    def __init__(self, model_path: Optional[Path] = None):
+    INFERENCE_BACKEND = "torch"
+    POSTPROCESSING_WORKERS = 1
+
+    WALL_THRESHOLD = 0.08
+    WALL_RECTANGLE_PARAMETERS = dict(
+        hough_threshold=11,
+        hough_min_length=13,
+        hough_max_gap=15,
+        hough_angles=np.arange(0, np.pi, np.pi / 64),
+        segment_min_width=1,
+        segment_min_length=10,
+        segment_width_percentiles=25,
+        segment_min_width_percentile=50,
+        segment_snap_distance=20,
+        corner_scale_distance=30,
+    )
+    RAILING_THRESHOLD = 0.5
+    RAILING_RECTANGLE_PARAMETERS = dict(segment_min_width=0.5, segment_min_length=5)
+
+    def __init__(
+        self,
+        model_path: Optional[Path] = None,
+        tile_batch_size: Optional[int] = None,
+        accumulator_mode: Optional[str] = None,
+        accumulator_dtype=None,
+        backend: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        quantized: bool = False,
+        postprocessing_workers: Optional[int] = None,
+        skip_empty_tiles: Optional[bool] = None,
+        device: Optional[str] = None,
+    ):
+        """
+        backend: how the model is executed, one of `torch` (pickled module in eager
+            mode), `torchscript` or `onnx`. The exported models are expected next to
+            TORCH_MODEL_PATH with the backend's suffix, see bin/export_walls_model.py
+        num_threads: number of intra-op threads used by the backend
+        quantized: runs the INT8 quantized TorchScript model created by
+            bin/quantize_models.py instead, always on CPU
+        postprocessing_workers: number of threads used to extract the wall and
+            railing rectangles from the predicted masks
+        skip_empty_tiles: whether tiles without ink are skipped, their prediction
+            is background only
+        device: torch device the model is loaded on and run on, defaults to
+            TORCH_DEVICE
+        """
         from predictors.tasks.utils.logging import logger
 
+        backend = backend or self.INFERENCE_BACKEND
+        if device is not None:
+            self.TORCH_DEVICE = device
+        if quantized:
+            backend = "torchscript"
+            model_path = model_path or self.QUANTIZED_MODEL_PATH
+            self.TORCH_DEVICE = "cpu"
         if model_path is None:
-            model_path = self.TORCH_MODEL_PATH
+            model_path = self.TORCH_MODEL_PATH.with_suffix(
+                BACKENDS[backend].MODEL_SUFFIX
+            )
 
-        logger.info(f"WallPredictor using device {self.TORCH_DEVICE}")
-        self.model = torch.load(
-            model_path, map_location=torch.device(self.TORCH_DEVICE)
+        logger.info(
+            f"WallPredictor using device {self.TORCH_DEVICE} and {backend} backend"
+            f"{' (quantized)' if quantized else ''}"
+        )
+        self.model = get_backend(
+            name=backend,
+            model_path=model_path,
+            device=self.TORCH_DEVICE,
+            num_threads=num_threads,
+        )
+        self.tile_batch_size = tile_batch_size or self.TILE_BATCH_SIZE
+        self.accumulator_mode = accumulator_mode or self.ACCUMULATOR_MODE
+        if self.accumulator_mode not in TileMaskAccumulator.MODES:
+            raise ValueError(
+                f"accumulator_mode must be one of {TileMaskAccumulator.MODES}, "
+                f"got {self.accumulator_mode}."
+            )
+        self.accumulator_dtype = accumulator_dtype or self.ACCUMULATOR_DTYPE
+        self.postprocessing_workers = (
+            postprocessing_workers or self.POSTPROCESSING_WORKERS
+        )
+        self.skip_empty_tiles = (
+            self.SKIP_EMPTY_TILES if skip_empty_tiles is None else skip_empty_tiles
+        )
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def normalization_params(cls) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """Resolves the encoder's preprocessing once and folds it into a per channel
+        (scale, shift) such that the normalized image is `image * scale - shift`.
+        Also returns whether the channels have to be flipped (BGR encoders).
+        """
+        params = smp.encoders.get_preprocessing_params(cls.ENCODER, cls.ENCODER_WEIGHTS)
+        mean, std = np.array(params["mean"]), np.array(params["std"])
+        input_scale = 1 / 255 if params["input_range"][1] == 1 else 1
+        return (
+            (input_scale / std).astype("float32"),
+            (mean / std).astype("float32"),
+            params["input_space"] == "BGR",
         )
 
+    @staticmethod
+    def _has_255_range(image) -> bool:
+        return np.issubdtype(image.dtype, np.integer) or image.max() > 1
+
     def preprocess(self, image, **kwargs):
+        """Normalizes a (width, height, 3) image into a channel first float32 array"""
+        image = np.asarray(image)
+        scale, shift, flip_channels = self.normalization_params()
+        if not self._has_255_range(image):
+            scale = scale * 255
+
+        preprocessed = np.empty((3, *image.shape[:2]), dtype="float32")
+        preprocessed[...] = (image[..., ::-1] if flip_channels else image).transpose(
+            2, 0, 1
+        )
+        preprocessed *= scale[:, None, None]
+        preprocessed -= shift[:, None, None]
+        return preprocessed
+
+    def preprocess_batch(self, tiles: np.ndarray) -> torch.Tensor:
+        """Normalizes a (N, width, height, 3) batch of tiles on the torch device,
+        the tiles are only converted to float32 once they are on the device.
+        """
+        scale, shift, flip_channels = self.normalization_params()
+        if not self._has_255_range(tiles):
+            scale = scale * 255
+
+        x_tensor = torch.from_numpy(tiles).to(self.TORCH_DEVICE).permute(0, 3, 1, 2)
+        if flip_channels:
+            x_tensor = x_tensor.flip(1)
         return (
-            smp.encoders.get_preprocessing_fn(self.ENCODER, self.ENCODER_WEIGHTS)(image)
-            .transpose(2, 0, 1)
-            .astype("float32")
+            x_tensor.float()
+            .mul_(torch.from_numpy(scale).to(self.TORCH_DEVICE).view(1, 3, 1, 1))
+            .sub_(torch.from_numpy(shift).to(self.TORCH_DEVICE).view(1, 3, 1, 1))
+            .contiguous()
         )
 
     def predict(self, image) -> MultiClassPrediction:
         pred_mask = self.predict_tiled(image=image)
 
-        wall_mask = np.clip(
-            np.maximum.reduce(
-                [
-                    pred_mask[SegmentationLabel.SEPARATORS.value],
-                    pred_mask[SegmentationLabel.WALLS.value],
-                    pred_mask[SegmentationLabel.OPENINGS.value],
-                    pred_mask[SegmentationLabel.DOORS.value],
-                    pred_mask[SegmentationLabel.WINDOWS.value],
-                ]
-            )
-            - dilation(pred_mask[SegmentationLabel.RAILINGS.value], square(3)),
-            0,
-            1,
-        )
+        wall_mask, railing_mask = self.get_wall_and_railing_masks(pred_mask)
         window_mask = pred_mask[SegmentationLabel.WINDOWS.value]
         door_mask = pred_mask[SegmentationLabel.DOORS.value]
 
-        wall_shapes = MaskPostprocessor.get_rectangles(
-            mask=wall_mask,
-            pred_threshold=0.08,
-            hough_threshold=11,
-            hough_min_length=13,
-            hough_max_gap=15,
-            hough_angles=np.arange(0, np.pi, np.pi / 64),
-            segment_min_width=1,
-            segment_min_length=10,
-            segment_width_percentiles=25,
-            segment_min_width_percentile=50,
-            segment_snap_distance=20,
-            corner_scale_distance=30,
+        wall_shapes, railing_shapes = MaskPostprocessor.get_multiclass_rectangles(
+            masks=[wall_mask, railing_mask],
+            parameters=[
+                self.WALL_RECTANGLE_PARAMETERS,
+                self.RAILING_RECTANGLE_PARAMETERS,
+            ],
+            workers=self.postprocessing_workers,
         )
         wall_labels = (ClassLabel.WALL,) * len(wall_shapes)
-
-        railing_shapes = self.predict_railings(pred_mask=pred_mask)
         railing_labels = (ClassLabel.RAILING,) * len(railing_shapes)
 
-        door_shapes = [
-            self.adjust_geometry_to_wall(opening=shape, wall=wall)
-            for shape in get_polygons(mask_to_shape(door_mask > 0.001))
-            for wall in wall_shapes
-            if shape.intersects(wall)
-        ]
-        door_shapes = [s for s in door_shapes if s is not None and not s.is_empty]
+        door_shapes = self.adjust_openings_to_walls(
+            openings=list(get_polygons(mask_to_shape(door_mask > 0.001))),
+            walls=wall_shapes,
+        )
         door_labels = (ClassLabel.DOOR,) * len(door_shapes)
 
-        window_shapes = [
-            self.adjust_geometry_to_wall(opening=shape, wall=wall)
-            for shape in get_polygons(mask_to_shape(window_mask > 0.001))
-            for wall in wall_shapes
-            if shape.intersects(wall)
-        ]
-        window_shapes = [s for s in window_shapes if s is not None and not s.is_empty]
+        window_shapes = self.adjust_openings_to_walls(
+            openings=list(get_polygons(mask_to_shape(window_mask > 0.001))),
+            walls=wall_shapes,
+        )
         window_labels = (ClassLabel.WINDOW,) * len(window_shapes)
 
         labels = wall_labels + railing_labels + door_labels + window_labels
@@ -145,50 +252,254 @@ class WallPredictor(BasePredictor):
         )
         return labels, tuple(shapes)
 
-    def predict_railings(self, pred_mask: np.ndarray) -> Tuple[Polygon, ...]:
-        railing_polygons = MaskPostprocessor.get_rectangles(
-            mask=np.maximum.reduce(
-                [
-                    pred_mask[SegmentationLabel.RAILINGS.value],
-                ]
-            ),
-            segment_min_width=0.5,
-            segment_min_length=5,
+    @classmethod
+    def get_wall_and_railing_masks(
+        cls, pred_mask: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Thresholded uint8 masks of the walls and the railings. The wall mask is
+        the maximum of all wall like classes minus the dilated railings.
+        """
+        railings = pred_mask[SegmentationLabel.RAILINGS.value]
+        walls = np.maximum(
+            pred_mask[SegmentationLabel.SEPARATORS.value],
+            pred_mask[SegmentationLabel.WALLS.value],
+            dtype=np.float32,
         )
+        for label in (
+            SegmentationLabel.OPENINGS,
+            SegmentationLabel.DOORS,
+            SegmentationLabel.WINDOWS,
+        ):
+            np.maximum(walls, pred_mask[label.value], out=walls)
+        np.subtract(walls, cls._dilate_3x3(railings), out=walls)
 
-        return tuple(railing_polygons)
+        return (
+            np.greater(walls, cls.WALL_THRESHOLD).view(np.uint8),
+            np.greater(railings, cls.RAILING_THRESHOLD).view(np.uint8),
+        )
+
+    @staticmethod
+    def _dilate_3x3(mask: np.ndarray) -> np.ndarray:
+        """Grey dilation with a 3x3 square in the mask's dtype (e.g. float16, which
+        OpenCV and scipy don't support), the border pixels are not padded
+        """
+        rows_dilated = mask.copy()
+        np.maximum(rows_dilated[1:], mask[:-1], out=rows_dilated[1:])
+        np.maximum(rows_dilated[:-1], mask[1:], out=rows_dilated[:-1])
+        dilated = rows_dilated.copy()
+        np.maximum(dilated[:, 1:], rows_dilated[:, :-1], out=dilated[:, 1:])
+        np.maximum(dilated[:, :-1], rows_dilated[:, 1:], out=dilated[:, :-1])
+        return dilated
+
+    def predict_tile_batch(self, tiles: List[np.ndarray]) -> np.ndarray:
+        """Runs a single forward pass over a batch of equally sized tiles and
+        returns the predictions as an array of shape (N, classes, width, height)
+        """
+        return self.model(self.preprocess_batch(np.stack(tiles)))
+
+    def _skip_empty_tiles(self, image, tile_bounds, accumulator):
+        """Adds a background only prediction for the tiles without ink and returns
+        the bounds of the tiles the model has to be run on"""
+        from predictors.tasks.utils.metrics import record_metric
+
+        screen = EmptyTileScreen(image)
+        empty_tile_mask = np.zeros((len(self.CLASSES), 1, 1), dtype=np.float32)
+        empty_tile_mask[self.CLASSES.index(SegmentationLabel.BACKGROUND)] = 1
+
+        non_empty_tile_bounds = []
+        for x1, y1, x2, y2 in tile_bounds:
+            if screen.is_empty(x1, y1, x2, y2):
+                accumulator.add(
+                    x1,
+                    y1,
+                    x2,
+                    y2,
+                    np.broadcast_to(
+                        empty_tile_mask, (len(self.CLASSES), x2 - x1, y2 - y1)
+                    ),
+                )
+            else:
+                non_empty_tile_bounds.append((x1, y1, x2, y2))
+        record_metric("walls_empty_tile_skip_rate", screen.skip_rate)
+        return non_empty_tile_bounds
 
     def predict_tiled(self, image: Image) -> np.array:
         image = np.asarray(image)
         width, height = image.shape[:2]
 
-        mask = np.zeros((width, height, len(self.CLASSES)))
-        for x1, y1, x2, y2 in get_image_tile_bounds(
+        accumulator = TileMaskAccumulator(
             width=width,
             height=height,
+            classes=len(self.CLASSES),
             tile_size=self.TILE_SIZE,
-            tile_stride=self.TILE_SIZE - 128,
-        ):
-            tile = pad_image_if_needed(
-                image[x1:x2, y1:y2, :],
-                min_width=self.TILE_SIZE,
-                min_height=self.TILE_SIZE,
+            tile_overlap=self.TILE_OVERLAP,
+            mode=self.accumulator_mode,
+            dtype=self.accumulator_dtype,
+        )
+        tile_bounds = get_image_tile_bounds(
+            width=width,
+            height=height,
+            tile_size=self.TILE_SIZE,
+            tile_stride=self.TILE_SIZE - self.TILE_OVERLAP,
+        )
+        if self.skip_empty_tiles:
+            tile_bounds = self._skip_empty_tiles(
+                image=image, tile_bounds=tile_bounds, accumulator=accumulator
             )
-            preprocessed_tile = self.preprocess(tile)
-            x_tensor = (
-                torch.from_numpy(preprocessed_tile).to(self.TORCH_DEVICE).unsqueeze(0)
+        for batch_bounds in batched(tile_bounds, self.tile_batch_size):
+            pred_masks = self.predict_tile_batch(
+                tiles=[
+                    pad_image_if_needed(
+                        image[x1:x2, y1:y2, :],
+                        min_width=self.TILE_SIZE,
+                        min_height=self.TILE_SIZE,
+                    )
+                    for x1, y1, x2, y2 in batch_bounds
+                ]
             )
-            pred_mask = (
-                self.model(x_tensor).detach().squeeze().cpu().numpy().transpose(1, 2, 0)
+            for (x1, y1, x2, y2), pred_mask in zip(batch_bounds, pred_masks):
+                unpadded_pred_mask = unpad_image_if_needed(
+                    pred_mask.transpose(1, 2, 0),
+                    original_width=x2 - x1,
+                    original_height=y2 - y1,
+                ).transpose(2, 0, 1)
+                accumulator.add(x1, y1, x2, y2, unpadded_pred_mask)
+        return accumulator.result()
+
+    @classmethod
+    def adjust_openings_to_walls(
+        cls, openings: List[Polygon], walls: Tuple[Polygon, ...]
+    ) -> List[Polygon]:
+        """Adjusts each opening to the wall it overlaps the most. If the adjustment
+        to that wall fails, the other intersecting walls are tried by decreasing
+        overlap. Openings not intersecting any wall are dropped.
+        """
+        if not openings or not walls:
+            return []
+
+        openings_array, walls_array = np.array(openings), np.array(walls)
+        opening_indices, wall_indices = STRtree(walls_array).query(
+            openings_array, predicate="intersects"
+        )
+        overlaps = shapely.area(
+            shapely.intersection(
+                openings_array[opening_indices], walls_array[wall_indices]
             )
-            unpadded_pred_mask = unpad_image_if_needed(
-                pred_mask, original_width=x2 - x1, original_height=y2 - y1
+        )
+        if not len(opening_indices):
+            return []
+
+        order = np.lexsort((wall_indices, -overlaps, opening_indices))
+        opening_indices, wall_indices = opening_indices[order], wall_indices[order]
+
+        # the best candidate walls of all openings are adjusted in one batch, the
+        # next candidates only for the openings which couldn't be adjusted
+        adjusted_openings = np.full(len(openings), None, dtype=object)
+        candidate_ranks = np.arange(len(order)) - np.searchsorted(
+            opening_indices, opening_indices
+        )
+        for rank in range(candidate_ranks.max() + 1):
+            is_candidate = (candidate_ranks == rank) & shapely.is_missing(
+                adjusted_openings[opening_indices]
             )
-            mask[x1:x2, y1:y2, :] = np.maximum(
-                mask[x1:x2, y1:y2, :],
-                unpadded_pred_mask,
+            adjusted = cls.adjust_geometries_to_walls(
+                openings=openings_array[opening_indices[is_candidate]],
+                walls=walls_array[wall_indices[is_candidate]],
             )
-        return mask.transpose(2, 0, 1)
+            is_adjusted = ~(shapely.is_missing(adjusted) | shapely.is_empty(adjusted))
+            adjusted_openings[opening_indices[is_candidate][is_adjusted]] = adjusted[
+                is_adjusted
+            ]
+
+        return list(adjusted_openings[~shapely.is_missing(adjusted_openings)])
+
+    @staticmethod
+    def _get_closest_parts(lines: np.ndarray, geometries: np.ndarray) -> np.ndarray:
+        """Replaces the multi line strings by their non empty part closest to the
+        corresponding geometry
+        """
+        (multi_indices,) = np.nonzero(
+            shapely.get_type_id(lines) == shapely.GeometryType.MULTILINESTRING
+        )
+        if not len(multi_indices):
+            return lines
+
+        parts, part_indices = shapely.get_parts(lines[multi_indices], return_index=True)
+        is_not_empty = ~shapely.is_empty(parts)
+        parts, part_indices = parts[is_not_empty], part_indices[is_not_empty]
+        distances = shapely.distance(parts, geometries[multi_indices][part_indices])
+        parts_by_distance = np.lexsort((distances, part_indices))
+        _, first_parts = np.unique(part_indices[parts_by_distance], return_index=True)
+        closest_parts = parts_by_distance[first_parts]
+
+        lines = lines.copy()
+        lines[multi_indices[part_indices[closest_parts]]] = parts[closest_parts]
+        return lines
+
+    @classmethod
+    def adjust_geometries_to_walls(
+        cls, openings: np.ndarray, walls: np.ndarray
+    ) -> np.ndarray:
+        """Vectorized adjust_geometry_to_wall of the arrays of openings and the walls
+        they belong to, the result is None where an opening can't be adjusted.
+        """
+        adjusted_openings = np.full(len(openings), None, dtype=object)
+        rectangles = shapely.oriented_envelope(openings)
+        (indices,) = np.nonzero(
+            (shapely.get_type_id(rectangles) == shapely.GeometryType.POLYGON)
+            & (shapely.get_num_coordinates(rectangles) == 5)
+        )
+        if not len(indices):
+            return adjusted_openings
+        openings, walls = openings[indices], walls[indices]
+
+        long_lines, short_lines = get_center_lines_from_rectangles(rectangles[indices])
+        # the short center line scaled by 5 about its center
+        centers = (short_lines.min(axis=1) + short_lines.max(axis=1)) / 2
+        orthogonal_axes = short_lines * 5 + (centers - centers * 5)[:, None]
+        half_normals = ((long_lines[:, 1] - long_lines[:, 0]) / 2)[:, None]
+
+        center_left, center_right = (
+            shapely.centroid(
+                cls._get_closest_parts(
+                    shapely.intersection(shapely.linestrings(axes), walls), openings
+                )
+            )
+            for axes in (orthogonal_axes - half_normals, orthogonal_axes + half_normals)
+        )
+        (is_valid,) = np.nonzero(
+            ~(shapely.is_empty(center_left) | shapely.is_empty(center_right))
+        )
+        center_axes = np.stack(
+            [
+                shapely.get_coordinates(center_left[is_valid]),
+                shapely.get_coordinates(center_right[is_valid]),
+            ],
+            axis=1,
+        )
+
+        # the center axes rotated by 90 degrees about their centroids
+        origins = shapely.get_coordinates(
+            shapely.centroid(shapely.linestrings(center_axes))
+        )[:, None]
+        normal_axes = np.stack(
+            [
+                -center_axes[:, :, 1] + (origins[:, :, 0] + origins[:, :, 1]),
+                center_axes[:, :, 0] + (origins[:, :, 1] - origins[:, :, 0]),
+            ],
+            axis=2,
+        )
+
+        adjusted_openings[indices[is_valid]] = shapely.buffer(
+            shapely.linestrings(center_axes),
+            shapely.length(
+                shapely.intersection(shapely.linestrings(normal_axes), walls[is_valid])
+            )
+            / 2,
+            cap_style="flat",
+            join_style="mitre",
+        )
+        return adjusted_openings
 
     @classmethod
     def adjust_geometry_to_wall(
@@ -238,48 +549,262 @@ class WallPredictor(BasePredictor):
 
 
 class MaskPostprocessor:
+    DEFAULT_PARAMETERS = dict(
+        hough_threshold=10,
+        hough_min_length=10,
+        hough_max_gap=5,
+        hough_angles=None,
+        segment_min_width=1,
+        segment_min_length=20,
+        segment_width_percentiles=25,
+        segment_min_width_percentile=50,
+        segment_snap_distance=20,
+        corner_scale_distance=20,
+    )
+
+    @staticmethod
+    def _get_line_corners(line, corners, corner_tree, max_distance):
+        """Projections onto the line of the corners closer than max_distance,
+        sorted along the line
+        """
+        if line.is_empty:
+            return np.empty((0, 2))
+
+        (start_x, start_y), (end_x, end_y) = line.coords[0], line.coords[-1]
+        candidates = corner_tree.query(
+            box(
+                min(start_x, end_x) - max_distance,
+                min(start_y, end_y) - max_distance,
+                max(start_x, end_x) + max_distance,
+                max(start_y, end_y) + max_distance,
+            )
+        )
+        candidates.sort()
+
+        start = np.array([start_x, start_y])
+        direction = np.array([end_x - start_x, end_y - start_y])
+        offsets = corners[candidates] - start
+        projections = np.clip(offsets @ direction / (direction @ direction), 0, 1)
+        projected_corners = start + projections[:, None] * direction
+
+        is_close = (
+            np.linalg.norm(corners[candidates] - projected_corners, axis=1)
+            < max_distance
+        )
+        projected_corners, projections = (
+            projected_corners[is_close],
+            projections[is_close],
+        )
+        return projected_corners[np.argsort(projections, kind="stable")]
+
+    @classmethod
+    def _get_line_segments(cls, line, corners, corner_tree, segment_min_length):
+        """Segments between consecutive corners along the line which are longer
+        than segment_min_length, as (N, 2, 2) array
+        """
+        line_corners = cls._get_line_corners(
+            line=line,
+            corners=corners,
+            corner_tree=corner_tree,
+            max_distance=segment_min_length / 2,
+        )
+        segments = np.stack([line_corners[:-1], line_corners[1:]], axis=1)
+        return segments[
+            np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1) > segment_min_length
+        ]
+
     @staticmethod
-    def _get_rectangles_from_line(
-        line,
-        corners,
+    def _get_segment_width_percentiles(medial_axis_distance, segments, percentiles):
+        """Samples the medial axis distance along all segments in a single pass and
+        returns the (percentiles, N) array of the width percentiles of each segment.
+
+        The samples are the same as skimage's profile_line: linearly interpolated,
+        one per pixel of length and including both ends of the segment.
+        """
+        if not len(segments):
+            return np.empty((len(percentiles), 0))
+
+        starts, ends = segments[:, 0], segments[:, 1]
+        lengths = np.ceil(np.hypot(*(ends - starts).T) + 1).astype(int)
+        offsets = np.cumsum(lengths) - lengths
+        sample_segments = np.repeat(np.arange(len(segments)), lengths)
+        sample_steps = np.arange(lengths.sum()) - offsets[sample_segments]
+        samples = (
+            sample_steps[:, None]
+            * ((ends - starts) / (lengths - 1)[:, None])[sample_segments]
+            + starts[sample_segments]
+        )
+        samples[offsets + lengths - 1] = ends
+        widths = map_coordinates(
+            medial_axis_distance.T, samples.T, order=1, mode="reflect", prefilter=False
+        )
+
+        width_percentiles = np.empty((len(percentiles), len(segments)))
+        for length in np.unique(lengths):
+            (indices,) = np.nonzero(lengths == length)
+            width_percentiles[:, indices] = np.percentile(
+                widths[offsets[indices, None] + np.arange(length)], percentiles, axis=1
+            )
+        return width_percentiles
+
+    @staticmethod
+    def _get_crops(mask, margin):
+        """Splits the mask into the crops of its connected components, components
+        closer than margin to each other are kept in the same crop. Each crop is
+        padded by margin.
+
+        Yields the row and column slices of each crop and the mask of its components
+        within the crop.
+        """
+        kernel = np.ones((margin + 1, margin + 1), dtype=np.uint8)
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+            cv2.dilate(mask, kernel), connectivity=8
+        )
+        for label in range(1, num_labels):
+            column, row, width, height = stats[label, :4]
+            rows = slice(max(row - margin, 0), row + height + margin)
+            columns = slice(max(column - margin, 0), column + width + margin)
+            yield rows, columns, labels[rows, columns] == label
+
+    @staticmethod
+    def _get_crop_skeleton_and_distance(crop_mask):
+        """Skeleton and medial axis distance of the components of a crop, the same as
+        within the full mask as the crop contains the background around them"""
+        # same as the distance returned by skimage's medial_axis, without computing
+        # the medial axis itself
+        return skeletonize(crop_mask, method="lee"), distance_transform_edt(crop_mask)
+
+    @classmethod
+    def _get_segments(
+        cls,
+        skeleton,
         medial_axis_distance,
+        hough_threshold,
+        hough_min_length,
+        hough_max_gap,
+        hough_angles,
         segment_min_width,
         segment_min_length,
-        segment_width_percentile,
+        segment_width_percentiles,
         segment_min_width_percentile,
         segment_snap_distance,
+        corner_scale_distance,
+        map_=map,
     ):
-        intersecting_corners = []
-        for corner in corners:
-            if line.distance(corner) < segment_min_length / 2:
-                intersecting_corners.append(line.interpolate(line.project(corner)))
+        """Wall segments of the skeleton as (N, 2, 2) array and their widths"""
+        line_proposals, corners = cls._get_line_proposals(
+            skeleton=skeleton,
+            hough_threshold=hough_threshold,
+            hough_min_length=hough_min_length,
+            hough_max_gap=hough_max_gap,
+            hough_angles=hough_angles,
+            corner_scale_distance=corner_scale_distance,
+        )
 
-        intersecting_corners_sorted = [
-            c for c in sorted(intersecting_corners, key=lambda z: line.project(z))
-        ]
+        get_line_segments = partial(
+            cls._get_line_segments,
+            corners=corners,
+            corner_tree=STRtree(points(corners)),
+            segment_min_length=segment_min_length,
+        )
+        segments = np.concatenate(
+            [np.empty((0, 2, 2)), *map_(get_line_segments, line_proposals)]
+        )
 
-        rectangles = []
-        for segment_start, segment_end in zip(
-            intersecting_corners_sorted[:-1], intersecting_corners_sorted[1:]
-        ):
-            segment_widths = profile_line(
-                image=medial_axis_distance.T,
-                src=segment_start.coords[0],
-                dst=segment_end.coords[0],
+        min_segment_widths, segment_widths = cls._get_segment_width_percentiles(
+            medial_axis_distance=medial_axis_distance,
+            segments=segments,
+            percentiles=[segment_min_width_percentile, segment_width_percentiles],
+        )
+        is_wide_enough = min_segment_widths > segment_min_width
+        return segments[is_wide_enough], segment_widths[is_wide_enough]
+
+    @staticmethod
+    def _buffer_segments(segments, widths) -> Tuple[Polygon, ...]:
+        rectangles = buffer(
+            linestrings(segments), widths, cap_style="square", join_style="mitre"
+        )
+        return tuple([r for r in rectangles if r is not None and not r.is_empty])
+
+    @classmethod
+    def get_multiclass_rectangles(
+        cls,
+        masks: List[np.ndarray],
+        parameters: List[Dict],
+        workers: int = 1,
+    ) -> Tuple[Tuple[Polygon, ...], ...]:
+        """Rectangles of several binary masks. The skeletons and medial axis distances
+        are only computed on the crops of the connected components of all masks, such
+        that the background is skipped. They are assembled in zero initialized full
+        size arrays, of which only the pages of the crops are written, and the line
+        proposals are found and matched with the corners on the full mask.
+
+        masks: uint8 masks of the same shape, with 1 for foreground pixels
+        parameters: keyword arguments of get_rectangles for each mask, missing
+            ones take their default values
+        workers: number of threads the crops and line proposals are processed with
+        """
+        parameters = [
+            {**cls.DEFAULT_PARAMETERS, **mask_parameters}
+            for mask_parameters in parameters
+        ]
+        union_mask = masks[0].copy()
+        for mask in masks[1:]:
+            np.bitwise_or(union_mask, mask, out=union_mask)
+        crops = list(
+            cls._get_crops(
+                mask=union_mask,
+                margin=max(
+                    max(p["corner_scale_distance"], p["segment_min_length"])
+                    for p in parameters
+                ),
             )
-            min_segment_width = np.percentile(
-                segment_widths, segment_min_width_percentile
+        )
+        del union_mask
+
+        def get_crop_skeletons_and_distances(crop):
+            rows, columns, components = crop
+            return [
+                cls._get_crop_skeleton_and_distance(crop_mask)
+                if (crop_mask := mask[rows, columns] * components).any()
+                else None
+                for mask in masks
+            ]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            map_ = executor.map if workers > 1 else map
+            crops_skeletons_and_distances = list(
+                map_(get_crop_skeletons_and_distances, crops)
             )
-            segment_width = np.percentile(segment_widths, segment_width_percentile)
-            if (
-                min_segment_width > segment_min_width
-                and segment_start.distance(segment_end) > segment_min_length
-            ):
-                rectangle = LineString([segment_start, segment_end]).buffer(
-                    segment_width, cap_style=3, join_style=2
+
+            multiclass_rectangles = []
+            for i, (mask, mask_parameters) in enumerate(zip(masks, parameters)):
+                skeleton = np.zeros(mask.shape, dtype=np.uint8)
+                medial_axis_distance = np.zeros(mask.shape)
+                for (rows, columns, _), skeletons_and_distances in zip(
+                    crops, crops_skeletons_and_distances
+                ):
+                    if skeletons_and_distances[i] is None:
+                        continue
+                    crop_skeleton, crop_distance = skeletons_and_distances[i]
+                    # crops of close components overlap, each pixel is foreground
+                    # in at most one of them
+                    crop_skeleton_out = skeleton[rows, columns]
+                    np.maximum(crop_skeleton_out, crop_skeleton, out=crop_skeleton_out)
+                    crop_distance_out = medial_axis_distance[rows, columns]
+                    np.maximum(crop_distance_out, crop_distance, out=crop_distance_out)
+
+                multiclass_rectangles.append(
+                    cls._buffer_segments(
+                        *cls._get_segments(
+                            skeleton=skeleton,
+                            medial_axis_distance=medial_axis_distance,
+                            map_=map_,
+                            **mask_parameters,
+                        )
+                    )
                 )
-                rectangles.append(rectangle)
-        return rectangles
+        return tuple(multiclass_rectangles)
 
     @classmethod
     def get_rectangles(
@@ -296,40 +821,33 @@ class MaskPostprocessor:
         segment_min_width_percentile=50,
         segment_snap_distance=20,
         corner_scale_distance=20,
+        workers=1,
     ) -> Tuple[Polygon, ...]:
-        wall_mask_gray = (mask > pred_threshold).astype(np.uint8)
-        _, medial_axis_distance = medial_axis(wall_mask_gray, return_distance=True)
-        line_proposals, corners = cls._get_line_proposals(
-            mask=wall_mask_gray,
-            hough_threshold=hough_threshold,
-            hough_min_length=hough_min_length,
-            hough_max_gap=hough_max_gap,
-            hough_angles=hough_angles,
-            corner_scale_distance=corner_scale_distance,
-        )
-
-        rectangles = chain(
-            *[
-                cls._get_rectangles_from_line(
-                    line=line,
-                    corners=corners,
-                    medial_axis_distance=medial_axis_distance,
+        """workers: number of threads the crops are processed with"""
+        (rectangles,) = cls.get_multiclass_rectangles(
+            masks=[np.greater(mask, pred_threshold).view(np.uint8)],
+            parameters=[
+                dict(
+                    hough_threshold=hough_threshold,
+                    hough_min_length=hough_min_length,
+                    hough_max_gap=hough_max_gap,
+                    hough_angles=hough_angles,
                     segment_min_width=segment_min_width,
                     segment_min_length=segment_min_length,
-                    segment_width_percentile=segment_width_percentiles,
+                    segment_width_percentiles=segment_width_percentiles,
                     segment_min_width_percentile=segment_min_width_percentile,
                     segment_snap_distance=segment_snap_distance,
+                    corner_scale_distance=corner_scale_distance,
                 )
-                for line in line_proposals
-            ]
+            ],
+            workers=workers,
         )
-
-        return tuple([r for r in rectangles if r is not None and not r.is_empty])
+        return rectangles
 
     @classmethod
     def _get_line_proposals(
         cls,
-        mask,
+        skeleton,
         hough_threshold=10,
         hough_min_length=10,
         hough_max_gap=5,
@@ -339,9 +857,8 @@ class MaskPostprocessor:
         if hough_angles is None:
             hough_angles = np.arange(0, np.pi, np.pi / 32)
 
-        width, height = mask.shape[:2]
+        width, height = skeleton.shape[:2]
         maxdim = max(height, width)
-        skeleton = skeletonize(mask, method="lee")
         image_box = box(0, 0, height, width)
 
         line_segments = []
@@ -353,26 +870,13 @@ class MaskPostprocessor:
             line_gap=hough_max_gap,
             theta=hough_angles,
         ):
-            line_segments.append(LineString([start, end]))
+            line_segments.append((start, end))
             lines.append(
                 scale(LineString([start, end]), maxdim, maxdim).intersection(image_box)
             )
 
-        corners = []
-        for i, line in enumerate(line_segments):
-            for _, other_line in enumerate(line_segments[i + 1 :], start=i + 1):
-                scaled_line = scale(
-                    line,
-                    1 + corner_scale_distance / line.length,
-                    1 + corner_scale_distance / line.length,
-                )
-                scaled_other_line = scale(
-                    other_line,
-                    1 + corner_scale_distance / other_line.length,
-                    1 + corner_scale_distance / other_line.length,
-                )
-                intersection = scaled_line.intersection(scaled_other_line)
-                if isinstance(intersection, Point) and not intersection.is_empty:
-                    corners.append(intersection)
+        corners = get_segment_intersections(
+            np.array(line_segments), extension=corner_scale_distance
+        )
 
         return lines, corners
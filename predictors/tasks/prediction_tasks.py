@@ -1,3 +1,4 @@
+import numpy as np
 from celery.signals import worker_process_init
 
 from predictors.celery_conf.celery_app import celery_app
@@ -5,12 +6,25 @@ from predictors.predictors.constants import ClassLabel
 from predictors.predictors.floorplans import FloorplanPredictor, get_models
 from predictors.tasks.background_mask import generate_background_shapes
 from predictors.tasks.statistics import calculate_stats
+from predictors.tasks.utils.cache import (
+    add_input_image_fingerprint,
+    cached_result,
+    prediction_cache_key,
+)
 from predictors.tasks.utils.celery import celery_schema
 from predictors.tasks.utils.logging import logger
-from predictors.tasks.utils.result_content import as_geojson, as_svg, from_geojson
+from predictors.tasks.utils.result_content import (
+    as_geojson,
+    as_svg,
+    as_wkb,
+    from_geojson,
+    from_wkb,
+)
 from predictors.tasks.utils.serialization import (
+    PredictionGeometriesSchema,
     PredictionInputSchema,
     PredictionResultSchema,
+    RoiResultSchema,
     StatisticsResultSchema,
 )
 
@@ -33,25 +47,60 @@ def preload_model(*args, **kwargs):
     prediction_task.models
 
 
+def _labels_and_shapes(prediction_result):
+    if prediction_result.get("wkb") is not None:
+        return from_wkb(prediction_result["wkb"])
+    return from_geojson(prediction_result["json"]) or ((), ())
+
+
+def _predict_roi(input_image):
+    return [
+        tuple(map(int, bbox.bounds))
+        for bbox in prediction_task.models["roi"].predict(input_image)
+    ]
+
+
+@celery_app.task(ignore_result=False)
+@add_input_image_fingerprint
+@celery_schema(kwargs=PredictionInputSchema(only=["input_image"]), dump=RoiResultSchema)
+def roi_task(input_image):
+    """Predicts the regions of interest of an image and fetches the image's
+    fingerprint for the result cache once for all the model tasks chained after
+    it."""
+    return {"roi": _predict_roi(input_image)}
+
+
 @celery_app.task(base=PredictionTask, ignore_result=False)
-@celery_schema(kwargs=PredictionInputSchema, dump=PredictionResultSchema)
-def prediction_task(input_image, model, result_types, roi=None, pixels_per_meter=None):
+@cached_result(key=prediction_cache_key)
+@celery_schema(
+    args=RoiResultSchema, kwargs=PredictionInputSchema, dump=PredictionResultSchema
+)
+def prediction_task(
+    roi_result=None,
+    *,
+    input_image,
+    model,
+    result_types,
+    roi=None,
+    pixels_per_meter=None,
+):
     """Predicts the class labels and shapes for a given image using a specified predictor method.
 
     Args:
+        roi_result (dict, optional): The result of the roi_task if chained after it.
+            Its regions of interest are used if no roi is given. Defaults to None.
         input_image (np.ndarray): The input image for prediction.
         model (str): The name of the model to use for prediction.
-        result_types (list): A list of result types to return (e.g., 'svg', 'json').
+        result_types (list): A list of result types to return (e.g., 'svg', 'json',
+            'wkb').
         roi (list, optional): A list of region of interest tuples. Defaults to None.
         pixels_per_meter (float, optional): The number of pixels per meter for scaling. Defaults to None.
     Returns:
-        A dictionary containing the predicted class labels and shapes as SVG and GeoJSON.
+        A dictionary containing the predicted class labels and shapes as SVG, GeoJSON
+        and WKB.
     """
     if not roi:
-        roi = [
-            tuple(map(int, bbox.bounds))
-            for bbox in prediction_task.models["roi"].predict(input_image)
-        ]
+        roi = roi_result["roi"] if roi_result else _predict_roi(input_image)
 
     labels, shapes = FloorplanPredictor.predict(
         model=prediction_task.models[model],
@@ -65,21 +114,25 @@ def prediction_task(input_image, model, result_types, roi=None, pixels_per_meter
         result["svg"] = as_svg(labels, shapes, input_image.shape)
     if "json" in result_types:
         result["json"] = as_geojson(labels, shapes)
+    if "wkb" in result_types:
+        result["wkb"] = as_wkb(labels, shapes)
 
     return result
 
 
 @celery_app.task()
 @celery_schema(
-    args=PredictionResultSchema(many=True, only=["json"]), dump=StatisticsResultSchema
+    args=PredictionGeometriesSchema(many=True),
+    dump=StatisticsResultSchema,
 )
 def statistics_task(prediction_results):
-    labels, shapes = zip(
-        *[
-            label_and_shape
-            for result in prediction_results
-            for label_and_shape in zip(*from_geojson(result["json"]))
-        ]
+    results_labels, results_shapes = zip(
+        *[_labels_and_shapes(result) for result in prediction_results]
+    )
+    # the decoded geometry arrays are passed on without rebuilding the shapes
+    labels = [label for result_labels in results_labels for label in result_labels]
+    shapes = np.concatenate(
+        [np.asarray(result_shapes, dtype=object) for result_shapes in results_shapes]
     )
     return {
         "json": calculate_stats(labels, shapes),
@@ -88,7 +141,7 @@ def statistics_task(prediction_results):
 
 @celery_app.task()
 @celery_schema(
-    args=PredictionResultSchema(many=True, only=["json"]),
+    args=PredictionGeometriesSchema(many=True),
     kwargs=PredictionInputSchema(),
     dump=PredictionResultSchema,
 )
@@ -96,7 +149,7 @@ def background_mask_task(prediction_results, input_image):
     shapes = [
         shape
         for result in prediction_results
-        for shape in from_geojson(result["json"])[1]
+        for shape in _labels_and_shapes(result)[1]
     ]
     background_shapes = generate_background_shapes(input_image.shape, shapes)
     background_labels = (ClassLabel.BACKGROUND,) * len(background_shapes)
@@ -1,9 +1,9 @@
-from collections import defaultdict
+from typing import Tuple
 
-from shapely.ops import unary_union
+import numpy as np
+import shapely
 
 from predictors.predictors.constants import ClassLabel
-from predictors.predictors.utils.geometry import get_polygons
 
 PIXEL_TO_METER_RATIO = 40
 LABELS_CONSIDERED_BATH_EXCLUSIVE = {
@@ -15,6 +15,10 @@ LABELS_CONSIDERED_BATH_EXCLUSIVE = {
 
 
 def calculate_stats(labels, shapes):
+    """Labels and shapes can be sequences or arrays, e.g. the decoded geometry
+    arrays of the WKB results"""
+    labels = np.array([label.value for label in labels], dtype=np.int16)
+    shapes = np.asarray(shapes, dtype=object)
     room_count, bathroom_count, room_space, bathroom_space = get_room_stats(
         labels=labels, shapes=shapes
     )
@@ -42,43 +46,59 @@ def calculate_stats(labels, shapes):
     }
 
 
-def get_room_stats(labels, shapes):
-    from predictors.predictors.constants import ClassLabel
+def _union_area_and_count(geometries: np.ndarray) -> Tuple[float, int]:
+    """Area of the union of the geometries and the number of its polygons.
 
-    room_count = 0
-    bathroom_count = 0
-    room_pols = []
-    bathroom_pols = []
-    bath_pols = unary_union(
-        [
-            pol
-            for pol, label in zip(shapes, labels)
-            if label in LABELS_CONSIDERED_BATH_EXCLUSIVE
-        ]
+    Only the geometries intersecting others (found with an STRtree) are unioned,
+    the polygons of the others are parts of the union as they are.
+    """
+    geometries = geometries[~shapely.is_empty(geometries)]
+    pairs = shapely.STRtree(geometries).query(geometries, predicate="intersects")
+    unioned = np.zeros(len(geometries), dtype=bool)
+    unioned[pairs[0][pairs[0] != pairs[1]]] = True
+    # nested collections are unioned to count their polygons
+    unioned |= ~np.isin(
+        shapely.get_type_id(geometries),
+        [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON],
     )
-    for pol, label in zip(shapes, labels):
-        if label == ClassLabel.SPACE:
-            if pol.intersects(bath_pols):
-                bathroom_count += 1
-                bathroom_pols.append(pol)
-            else:
-                room_count += 1
-                room_pols.append(pol)
-    room_space = unary_union(room_pols).area / PIXEL_TO_METER_RATIO**2
-    bathroom_space = unary_union(bathroom_pols).area / PIXEL_TO_METER_RATIO**2
-    return room_count, bathroom_count, room_space, bathroom_space
 
+    union = shapely.union_all(geometries[unioned])
+    union_polygons = shapely.get_parts(union)
+    union_polygons = union_polygons[
+        shapely.get_type_id(union_polygons) == shapely.GeometryType.POLYGON
+    ]
+    area = shapely.area(geometries[~unioned]).sum() + shapely.area(union_polygons).sum()
+    count = shapely.get_num_geometries(geometries[~unioned]).sum() + len(union_polygons)
+    return float(area), int(count)
 
-def get_elements_stats(labels, shapes):
-    elements = defaultdict(list)
-    for pol, label in zip(shapes, labels):
-        elements[label].append(pol)
+
+def get_room_stats(labels: np.ndarray, shapes: np.ndarray):
+    spaces = shapes[labels == ClassLabel.SPACE.value]
+    bath_elements = shapes[
+        np.isin(labels, [label.value for label in LABELS_CONSIDERED_BATH_EXCLUSIVE])
+    ]
+    space_indices, _ = shapely.STRtree(bath_elements).query(
+        spaces, predicate="intersects"
+    )
+    is_bathroom = np.zeros(len(spaces), dtype=bool)
+    is_bathroom[space_indices] = True
+
+    room_space, _ = _union_area_and_count(spaces[~is_bathroom])
+    bathroom_space, _ = _union_area_and_count(spaces[is_bathroom])
+    return (
+        int(np.count_nonzero(~is_bathroom)),
+        int(np.count_nonzero(is_bathroom)),
+        room_space / PIXEL_TO_METER_RATIO**2,
+        bathroom_space / PIXEL_TO_METER_RATIO**2,
+    )
+
+
+def get_elements_stats(labels: np.ndarray, shapes: np.ndarray):
     result = {}
-    for label, pols in elements.items():
-        pols_union = unary_union(pols)
-        result[f"{label.name.lower()}_count"] = len(tuple(get_polygons(pols_union)))
-        result[f"{label.name.lower()}_space"] = (
-            pols_union.area / PIXEL_TO_METER_RATIO**2
-        )
+    for label_value in np.unique(labels):
+        label = ClassLabel(label_value)
+        area, count = _union_area_and_count(shapes[labels == label_value])
+        result[f"{label.name.lower()}_count"] = count
+        result[f"{label.name.lower()}_space"] = area / PIXEL_TO_METER_RATIO**2
 
     return result
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache, wraps
+from pathlib import Path
+from typing import Callable, Optional
+
+from predictors.tasks.utils.logging import logger
+from predictors.tasks.utils.metrics import record_metric
+from predictors.tasks.utils.serialization import SIGNED_URL_EXPIRATION
+from predictors.tasks.utils.storage import generate_signed_url, get_blob_fingerprint
+
+MODEL_FILES_DIRECTORY = Path("resources")
+# settings of the workers that change the predictions besides the request parameters
+PREDICTION_SETTINGS = (
+    "PREDICTORS_QUANTIZED",
+    "PREDICTORS_SKIP_EMPTY_TILES",
+    "DETECTRON_TILE_BATCH_SIZE",
+    "WALLS_INFERENCE_BACKEND",
+    "WALLS_ACCUMULATOR_MODE",
+)
+
+
+class ResultCache:
+    """Stores the JSON serializable results of tasks by key for ttl seconds"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set(self, key: str, result: dict):
+        raise NotImplementedError
+
+
+class RedisResultCache(ResultCache):
+    """Stores the results in the Redis of the celery result backend, evicted by
+    Redis once they expire"""
+
+    KEY_PREFIX = "result-cache:"
+
+    def __init__(self, ttl: int, **redis_conn_config):
+        import redis
+
+        super().__init__(ttl=ttl)
+        self.redis = redis.Redis(**redis_conn_config)
+
+    def get(self, key: str) -> Optional[dict]:
+        if (result := self.redis.get(self.KEY_PREFIX + key)) is not None:
+            return json.loads(result)
+        return None
+
+    def set(self, key: str, result: dict):
+        self.redis.setex(self.KEY_PREFIX + key, self.ttl, json.dumps(result))
+
+
+class DiskResultCache(ResultCache):
+    """Stores the results as JSON files in a local directory of the worker, expired
+    files are removed when they are read and when the cache is created"""
+
+    def __init__(self, ttl: int, directory: Path):
+        super().__init__(ttl=ttl)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in self.directory.glob("*.json"):
+            self._is_expired(path)
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(f"{key}.json")
+
+    def _is_expired(self, path: Path) -> bool:
+        if time.time() - path.stat().st_mtime > self.ttl:
+            path.unlink(missing_ok=True)
+            return True
+        return False
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            if self._is_expired(path):
+                return None
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, result: dict):
+        path = self._path(key)
+        # written to a temporary file first so that readers never see partial files
+        temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+        temporary_path.write_text(json.dumps(result))
+        temporary_path.replace(path)
+
+
+@lru_cache(maxsize=None)
+def get_result_cache() -> Optional[ResultCache]:
+    backend = os.environ.get("RESULT_CACHE_BACKEND")
+    ttl = int(os.environ.get("RESULT_CACHE_TTL", 86400))
+    if not backend:
+        return None
+    if backend == "redis":
+        from predictors.celery_conf.celery_config import redis_conn_config
+
+        return RedisResultCache(ttl=ttl, **redis_conn_config)
+    if backend == "disk":
+        return DiskResultCache(
+            ttl=ttl,
+            directory=Path(
+                os.environ.get("RESULT_CACHE_DIRECTORY", "/tmp/result-cache")
+            ),
+        )
+    raise ValueError(f"RESULT_CACHE_BACKEND must be redis or disk, got {backend}.")
+
+
+@lru_cache(maxsize=None)
+def get_model_files_version() -> str:
+    """Identifies the model files loaded by the worker by their names, sizes and
+    modification times, hashing their content would read all the weights again"""
+    model_files = []
+    for path in sorted(MODEL_FILES_DIRECTORY.glob("**/*")):
+        if path.is_file():
+            stat = path.stat()
+            model_files.append(
+                (
+                    path.relative_to(MODEL_FILES_DIRECTORY).as_posix(),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                )
+            )
+    return hashlib.sha256(json.dumps(model_files).encode()).hexdigest()
+
+
+def add_input_image_fingerprint(f):
+    """Decorator that adds the fingerprint of the task's input image to its result,
+    the tasks chained after it don't have to fetch the image's metadata again"""
+
+    @wraps(f)
+    def wrapper(*args, input_image, **kwargs):
+        result = f(*args, input_image=input_image, **kwargs)
+        if get_result_cache() is not None:
+            try:
+                fingerprint = get_blob_fingerprint(input_image["blob_name"])
+            except Exception:
+                logger.warning(
+                    "Fetching the input image metadata failed", exc_info=True
+                )
+            else:
+                result = {**result, "input_image_fingerprint": fingerprint}
+        return result
+
+    return wrapper
+
+
+def prediction_cache_key(
+    roi_result=None,
+    *,
+    input_image,
+    model,
+    result_types,
+    roi=None,
+    pixels_per_meter=None,
+) -> Optional[str]:
+    """Identifies a prediction by the content of the input image, the model files
+    and the settings of the worker and the parameters. RESULT_CACHE_VERSION only
+    has to be changed when the post-processing of the predictions changes.
+    The image's fingerprint is taken from the result of the roi_task if chained
+    after it, None is returned if the image can't be identified by its content."""
+    if roi_result and "input_image_fingerprint" in roi_result:
+        fingerprint = roi_result["input_image_fingerprint"]
+    else:
+        fingerprint = get_blob_fingerprint(input_image["blob_name"])
+    if fingerprint is None:
+        return None
+
+    return hashlib.sha256(
+        json.dumps(
+            {
+                "version": os.environ.get("RESULT_CACHE_VERSION", "1"),
+                "model_files": get_model_files_version(),
+                "settings": {
+                    setting: os.environ.get(setting) for setting in PREDICTION_SETTINGS
+                },
+                "input_image": fingerprint,
+                "model": model,
+                "result_types": sorted(result_types),
+                "roi": roi,
+                "pixels_per_meter": pixels_per_meter,
+            },
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+
+
+def _renew_signed_urls(result: dict) -> dict:
+    return {
+        result_type: {
+            **blob_urls,
+            "signed_url": generate_signed_url(
+                blob_urls["blob_name"], expiration=SIGNED_URL_EXPIRATION
+            ),
+        }
+        if isinstance(blob_urls, dict) and "signed_url" in blob_urls
+        else blob_urls
+        for result_type, blob_urls in result.items()
+    }
+
+
+def cached_result(key: Callable[..., str]):
+    """Decorator that caches the serialized result of a celery task, i.e. the blob
+    references of its results, under the key computed from the task's arguments,
+    results without key aren't cached. The cache is configured with
+    RESULT_CACHE_BACKEND (redis or disk, disabled if unset) and RESULT_CACHE_TTL. The signed urls of cached results are
+    renewed on a hit as they expire long before the cached results. Failures of
+    the cache are logged and the task is run as if there was no cache.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if (cache := get_result_cache()) is None:
+                return f(*args, **kwargs)
+
+            try:
+                cache_key = key(*args, **kwargs)
+                result = cache.get(cache_key) if cache_key is not None else None
+            except Exception:
+                logger.warning(
+                    f"Result cache lookup of {f.__name__} failed", exc_info=True
+                )
+                return f(*args, **kwargs)
+            if cache_key is None:
+                return f(*args, **kwargs)
+
+            record_metric(f"{f.__name__}_cache_hit", int(result is not None))
+            if result is not None:
+                return _renew_signed_urls(result)
+
+            result = f(*args, **kwargs)
+            try:
+                cache.set(cache_key, result)
+            except Exception:
+                logger.warning(
+                    f"Result cache update of {f.__name__} failed", exc_info=True
+                )
+            return result
+
+        return wrapper
+
+    return decorator
@@ -14,7 +14,8 @@ def celery_schema(
     Args:
         args (marshmallow.Schema or type[marshmallow.Schema] or None):
             Marshmallow schema used to deserialize the input arguments of the Celery task.
-            Only the first arg is deserialized as this is the argument/ result passed on from the parent task(s).
+            Only the first arg is deserialized as this is the argument/ result passed on from the parent task(s),
+            it is left out if the task is called without parent.
             If a type is passed, it will be instantiated with no arguments. Defaults to None.
         kwargs (marshmallow.Schema or type[marshmallow.Schema] or None):
             Marshmallow schema used to deserialize the keyword arguments of the Celery task.
@@ -71,7 +72,7 @@ def celery_schema(
     def decorator(f):
         @wraps(f)
         def wrapper(*a, **kw):
-            if args is not None:
+            if args is not None and a:
                 args_schema = args() if isinstance(args, type) else args
                 a = (args_schema.load(a[0]), *a[1:])
 
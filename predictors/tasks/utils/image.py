@@ -1,3 +1,9 @@
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
 import cv2
 import numpy as np
 
@@ -9,3 +15,66 @@ def greyscale_image(image):
 
 def decode_image_bytes(image_bytes):
     return cv2.imdecode(np.asarray(bytearray(image_bytes), dtype=np.uint8), 3)
+
+
+class DecodedImageCache:
+    """Host local cache of decoded images, shared by the worker processes as .npy
+    files. The images are memory mapped copy-on-write, so tasks can modify them
+    without affecting the cached file. The least recently used files are evicted
+    once the cache is larger than max_bytes.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(f"{hashlib.sha1(key.encode()).hexdigest()}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            image = np.load(path, mmap_mode="c")
+            path.touch()
+        except FileNotFoundError:
+            return None
+        return np.asarray(image)
+
+    def set(self, key: str, image: np.ndarray):
+        path = self._path(key)
+        # written to a temporary file first so that readers never see partial files
+        temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with temporary_path.open("wb") as f:
+            np.save(f, image)
+        temporary_path.replace(path)
+        self._evict()
+
+    def _evict(self):
+        files = []
+        for path in self.directory.glob("*.npy"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+
+@lru_cache(maxsize=None)
+def get_decoded_image_cache() -> Optional[DecodedImageCache]:
+    max_bytes = int(os.environ.get("DECODED_IMAGE_CACHE_SIZE_MB", 1024)) * 2**20
+    if not max_bytes:
+        return None
+    return DecodedImageCache(
+        directory=Path(
+            os.environ.get("DECODED_IMAGE_CACHE_DIRECTORY", "/tmp/decoded-image-cache")
+        ),
+        max_bytes=max_bytes,
+    )
@@ -0,0 +1,13 @@
+import os
+from distutils.util import strtobool
+
+from predictors.tasks.utils.logging import logger
+
+
+def record_metric(name: str, value: float):
+    """Logs the metric and adds it to the Scout APM trace of the running task"""
+    logger.info(f"{name}: {value}")
+    if strtobool(os.environ.get("SCOUT_ENABLED", "False")):
+        from scout_apm.api import Context
+
+        Context.add(name, value)
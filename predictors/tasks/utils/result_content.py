@@ -1,56 +1,54 @@
 import io
+from collections import defaultdict
 
 import numpy as np
-from matplotlib import pyplot
-from matplotlib.collections import PatchCollection
-from matplotlib.patches import PathPatch
-from matplotlib.path import Path
+import shapely
 from shapely.geometry import Polygon, mapping, shape
 
 from predictors.predictors.constants import COLORS, ClassLabel
 from predictors.predictors.utils.geometry import get_polygons
 
+# size (width, height) in pt of the axes of a default matplotlib figure, the image
+# is fitted into it to keep the size of the SVGs previously rendered by matplotlib
+SVG_MAX_SIZE = (357.12, 266.112)
 
-def _plot_polygon(ax, polygon: Polygon, **kwargs):
-    patches = []
-    if not polygon.is_empty:
-        path = Path.make_compound_path(
-            Path(np.asarray(polygon.exterior.coords)[:, :2]),
-            *[Path(np.asarray(ring.coords)[:, :2]) for ring in polygon.interiors],
-        )
-        patches.append(PathPatch(path, **kwargs))
-
-    collection = PatchCollection(patches, **kwargs)
 
-    ax.add_collection(collection, autolim=True)
-    return collection
+def _svg_path_data(polygon: Polygon) -> str:
+    """Exterior and interiors of the polygon as closed subpaths of one path"""
+    return " ".join(
+        "M " + " L ".join(f"{x:.2f} {y:.2f}" for x, y, *_ in ring.coords[:-1]) + " Z"
+        for ring in (polygon.exterior, *polygon.interiors)
+    )
 
 
 def as_svg(labels, shapes, image_shape, alpha=0.7) -> io.BytesIO:
-    image_out = io.BytesIO()
-    pyplot.clf()
+    """Writes the polygons of the shapes as filled paths in image coordinates, one
+    group with the fill color of the label per label"""
+    height, width = image_shape[:2]
+    scale = min(SVG_MAX_SIZE[0] / width, SVG_MAX_SIZE[1] / height)
 
-    fig, ax = pyplot.subplots()
+    polygons_by_label = defaultdict(list)
     for label, shape_ in zip(labels, shapes):
-        for polygon in get_polygons(shape_):
-            _plot_polygon(
-                ax, polygon, facecolor=[v / 255.0 for v in COLORS[label]], alpha=alpha
-            )
-
-    ax.set_axis_off()
-    ax.set_xlim(0, image_shape[1])
-    ax.set_ylim(image_shape[0], 0)
-    ax.set_aspect(1)
-
-    pyplot.savefig(
-        image_out,
-        bbox_inches="tight",
-        dpi=350,
-        pad_inches=0,
-        transparent=True,
-        format="svg",
+        polygons_by_label[label].extend(
+            polygon for polygon in get_polygons(shape_) if not polygon.is_empty
+        )
+
+    image_out = io.BytesIO()
+    image_out.write(
+        '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+        f'width="{width * scale:g}pt" height="{height * scale:g}pt" '
+        f'viewBox="0 0 {width} {height}">\n'.encode()
     )
-    pyplot.close(fig)
+    for label, polygons in polygons_by_label.items():
+        red, green, blue = COLORS[label]
+        image_out.write(
+            f'<g id="{label.name}" style="fill: #{red:02x}{green:02x}{blue:02x}; '
+            f'fill-opacity: {alpha}; fill-rule: evenodd">\n'.encode()
+        )
+        for polygon in polygons:
+            image_out.write(f'<path d="{_svg_path_data(polygon)}"/>\n'.encode())
+        image_out.write(b"</g>\n")
+    image_out.write(b"</svg>\n")
 
     image_out.seek(0)
     return image_out
@@ -77,3 +75,38 @@ def from_geojson(geojson):
             ]
         )
     )
+
+
+def as_wkb(labels, shapes) -> io.BytesIO:
+    """Packs the labels and shapes into an .npz file of the label values, the
+    concatenated WKB of the shapes and the offsets of each shape's WKB in it"""
+    wkbs = shapely.to_wkb(np.asarray(shapes, dtype=object))
+    offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+    np.cumsum([len(wkb) for wkb in wkbs], out=offsets[1:])
+
+    content = io.BytesIO()
+    np.savez(
+        content,
+        labels=np.array([label.value for label in labels], dtype=np.int16),
+        wkb=np.frombuffer(b"".join(wkbs), dtype=np.uint8),
+        offsets=offsets,
+    )
+    content.seek(0)
+    return content
+
+
+def from_wkb(content: bytes):
+    """Labels and the shapes as shapely geometry array"""
+    with np.load(io.BytesIO(content)) as arrays:
+        labels, wkb, offsets = (
+            arrays["labels"],
+            arrays["wkb"].tobytes(),
+            arrays["offsets"],
+        )
+    shapes = shapely.from_wkb(
+        np.array(
+            [wkb[start:end] for start, end in zip(offsets[:-1], offsets[1:])],
+            dtype=object,
+        )
+    )
+    return tuple(map(ClassLabel, labels.tolist())), shapes
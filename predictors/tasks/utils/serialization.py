@@ -1,13 +1,20 @@
 import os
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import timedelta
+from functools import lru_cache
 
-from marshmallow import EXCLUDE, Schema, fields, validates
+from marshmallow import EXCLUDE, Schema, fields, post_dump, pre_load, validates
 from marshmallow.exceptions import ValidationError
 from marshmallow.validate import Length
 
 from common.exceptions import InputImageException
-from predictors.tasks.utils.image import decode_image_bytes, greyscale_image
+from predictors.tasks.utils.image import (
+    decode_image_bytes,
+    get_decoded_image_cache,
+    greyscale_image,
+)
+from predictors.tasks.utils.logging import logger
 from predictors.tasks.utils.storage import download_blob, upload_blob
 
 SIGNED_URL_EXPIRATION = timedelta(
@@ -16,13 +23,39 @@ SIGNED_URL_EXPIRATION = timedelta(
 
 
 def _download_image(image_url, content_type):
+    # the tasks of a request run on the same host most of the time, the image is only
+    # downloaded and decoded once for them
+    cache = get_decoded_image_cache()
+    if cache is not None and (image := cache.get(image_url)) is not None:
+        return image
+
     image_bytes = download_blob(image_url, content_type)
     try:
         if (image := decode_image_bytes(image_bytes)) is not None:
-            return greyscale_image(image)
+            image = greyscale_image(image)
     except Exception as ex:
         raise InputImageException(f"{image_url} could not be loaded.") from ex
-    raise InputImageException(f"{image_url} could not be loaded.")
+    if image is None:
+        raise InputImageException(f"{image_url} could not be loaded.")
+
+    if cache is not None:
+        try:
+            cache.set(image_url, image)
+        except OSError:
+            logger.warning(f"Caching the decoded {image_url} failed", exc_info=True)
+    return image
+
+
+@lru_cache(maxsize=None)
+def _upload_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=int(os.environ.get("BLOB_UPLOAD_THREADS", 4)),
+        thread_name_prefix="blob-upload",
+    )
+
+
+# threads aren't forked, the worker processes need their own executor
+os.register_at_fork(after_in_child=_upload_executor.cache_clear)
 
 
 class BlobStore(fields.Field):
@@ -43,7 +76,9 @@ class BlobStore(fields.Field):
         self.content_type = content_type
 
     def _serialize(self, value, attr, obj, **kwargs):
-        return self.upload(
+        # the fields are uploaded concurrently, see BaseSchema.wait_for_uploads
+        return _upload_executor().submit(
+            self.upload,
             blob_name=str(uuid.uuid4()),
             content=value,
             content_type=self.content_type,
@@ -59,6 +94,13 @@ class BaseSchema(Schema):
     class Meta:
         unknown = EXCLUDE
 
+    @post_dump
+    def wait_for_uploads(self, data, **kwargs):
+        return {
+            key: value.result() if isinstance(value, Future) else value
+            for key, value in data.items()
+        }
+
 
 class PredictionResultSchema(BaseSchema):
     svg = BlobStore(
@@ -77,10 +119,29 @@ class PredictionResultSchema(BaseSchema):
         signed_url_expiration=SIGNED_URL_EXPIRATION,
         required=False,
     )
+    wkb = BlobStore(
+        upload=upload_blob,
+        download=download_blob,
+        content_type="application/octet-stream",
+        signed_url=True,
+        signed_url_expiration=SIGNED_URL_EXPIRATION,
+        required=False,
+    )
+
+
+class PredictionGeometriesSchema(PredictionResultSchema):
+    """Loads the labels and shapes of a prediction result, only the compact WKB is
+    downloaded if the result has it"""
+
+    @pre_load
+    def prefer_wkb(self, data, **kwargs):
+        if data.get("wkb") is not None:
+            return {"wkb": data["wkb"]}
+        return {"json": data.get("json")}
 
 
 class PredictionInputSchema(BaseSchema):
-    VALID_RESULT_TYPES = {"svg", "json"}
+    VALID_RESULT_TYPES = {"svg", "json", "wkb"}
 
     input_image = BlobStore(download=_download_image)
     result_types = fields.List(fields.Str(), validate=Length(min=1))
@@ -99,6 +160,10 @@ class PredictionInputSchema(BaseSchema):
             )
 
 
+class RoiResultSchema(BaseSchema):
+    roi = fields.List(fields.Tuple([fields.Int()] * 4))
+
+
 class StatisticsResultSchema(BaseSchema):
     json = BlobStore(
         upload=upload_blob,
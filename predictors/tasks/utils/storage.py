@@ -1,7 +1,8 @@
 import io
 import json
+import tempfile
 from datetime import timedelta
-from typing import Any, Optional, Union
+from typing import Any, BinaryIO, Iterator, Optional, Union
 
 from common.bucket import get_bucket
 
@@ -13,6 +14,39 @@ def download_blob(blob_name: str, content_type: Optional[str] = None):
     return blob.download_as_bytes()
 
 
+JSON_SPOOL_MAX_SIZE = 16 * 2**20
+JSON_CHUNK_ITEMS = 1024
+
+
+def _json_chunks(content: Any) -> Iterator[str]:
+    """Encodes the content like json.dumps, but the items of top level lists (e.g.
+    the features of a GeoJSON) are encoded in chunks of JSON_CHUNK_ITEMS"""
+    if not isinstance(content, dict):
+        yield json.dumps(content)
+        return
+
+    yield "{"
+    for i, (key, value) in enumerate(content.items()):
+        yield f"{', ' if i else ''}{json.dumps(key)}: "
+        if isinstance(value, list):
+            yield "["
+            for j in range(0, len(value), JSON_CHUNK_ITEMS):
+                # without the brackets of the encoded list of items
+                items = json.dumps(value[j : j + JSON_CHUNK_ITEMS])[1:-1]
+                yield f"{', ' if j else ''}{items}"
+            yield "]"
+        else:
+            yield json.dumps(value)
+    yield "}"
+
+
+def _remaining_size(file: BinaryIO) -> int:
+    position = file.tell()
+    size = file.seek(0, io.SEEK_END) - position
+    file.seek(position)
+    return size
+
+
 def upload_blob(
     blob_name: str,
     content: Union[io.BytesIO, Any],
@@ -20,11 +54,23 @@ def upload_blob(
     signed_url: bool = False,
     signed_url_expiration: Optional[timedelta] = None,
 ):
+    """Uploads the content, JSON serializable content if the content type is
+    application/json and a file otherwise. With the size known, the client uploads
+    small files in a single request and larger ones in chunks. The urls are signed
+    locally with the key of the service account."""
     blob = get_bucket().blob(blob_name)
     if content_type == "application/json":
-        blob.upload_from_string(json.dumps(content), content_type=content_type)
+        # the encoded JSON is only spooled to disk if it gets large
+        with tempfile.SpooledTemporaryFile(max_size=JSON_SPOOL_MAX_SIZE) as file:
+            for chunk in _json_chunks(content):
+                file.write(chunk.encode())
+            blob.upload_from_file(
+                file, content_type=content_type, rewind=True, size=file.tell()
+            )
     else:
-        blob.upload_from_file(content, content_type=content_type)
+        blob.upload_from_file(
+            content, content_type=content_type, size=_remaining_size(content)
+        )
 
     blob_urls = {"blob_name": blob_name}
     if signed_url:
@@ -32,3 +78,20 @@ def upload_blob(
             expiration=signed_url_expiration
         )
     return blob_urls
+
+
+def get_blob_fingerprint(blob_name: str) -> Optional[str]:
+    """Identifies the blob's content by the MD5 hash from its metadata. Blobs
+    without one, e.g. composite objects, are identified by their CRC32C checksum,
+    name and generation, None is returned if the metadata has neither."""
+    blob = get_bucket().blob(blob_name)
+    blob.reload()
+    if blob.md5_hash:
+        return f"md5:{blob.md5_hash}"
+    if blob.crc32c and blob.generation:
+        return f"crc32c:{blob.crc32c}:{blob_name}:{blob.generation}"
+    return None
+
+
+def generate_signed_url(blob_name: str, expiration: Optional[timedelta] = None):
+    return get_bucket().blob(blob_name).generate_signed_url(expiration=expiration)
@@ -1,3 +1,5 @@
+import base64
+import hashlib
 from pathlib import Path
 from unittest.mock import MagicMock
 
@@ -31,10 +33,14 @@ def api_client():
 def mock_gcp_client(monkeypatch):
     from google.cloud import storage
 
+    from common.bucket import reset_storage_client
+
     mock_client = MagicMock(spec=storage.Client)
     monkeypatch.setattr(storage, "Client", mock_client)
+    reset_storage_client()
 
-    return mock_client
+    yield mock_client
+    reset_storage_client()
 
 
 @pytest.fixture
@@ -64,18 +70,39 @@ def test_file_server(tmpdir_factory):
 
 
 @pytest.fixture
-def fake_bucket(test_file_server, monkeypatch):
+def fake_bucket(test_file_server, monkeypatch, tmp_path):
+    from predictors.tasks.utils.image import get_decoded_image_cache
+
+    # decoded images of other tests' buckets must not be reused
+    monkeypatch.setenv(
+        "DECODED_IMAGE_CACHE_DIRECTORY", tmp_path.joinpath("images").as_posix()
+    )
+    get_decoded_image_cache.cache_clear()
+
     class FakeBlob:
         def __init__(self, blob_name):
             self.blob_name = blob_name
+            self.md5_hash = None
+            self.crc32c = None
+            self.generation = None
+
+        def reload(self):
+            with open(Path(test_file_server, self.blob_name), mode="rb") as f:
+                self.md5_hash = base64.b64encode(
+                    hashlib.md5(f.read()).digest()
+                ).decode()
 
         def upload_from_string(self, content, content_type):
             with open(Path(test_file_server, self.blob_name), mode="w") as f:
                 f.write(content)
 
-        def upload_from_file(self, content, content_type):
+        def upload_from_file(
+            self, file_obj, content_type=None, rewind=False, size=None
+        ):
+            if rewind:
+                file_obj.seek(0)
             with open(Path(test_file_server, self.blob_name), mode="wb") as f:
-                f.write(content)
+                f.write(file_obj.read(-1 if size is None else size))
 
         def download_as_string(self):
             with open(Path(test_file_server, self.blob_name), mode="r") as f:
@@ -97,6 +124,8 @@ def fake_bucket(test_file_server, monkeypatch):
 
     monkeypatch.setattr(app.main, "get_bucket", FakeBucket)
     monkeypatch.setattr(predictors.tasks.utils.storage, "get_bucket", FakeBucket)
+    yield
+    get_decoded_image_cache.cache_clear()
 
 
 @pytest.fixture
@@ -124,3 +153,18 @@ def fake_icon_predictor(fake_predictor, monkeypatch):
         "get_models",
         lambda: {"icons_v2": fake_predictor},
     )
+
+
+@pytest.fixture
+def fake_walls_model(monkeypatch):
+    import torch
+
+    from predictors.predictors.walls import WallPredictor
+
+    class FakeWallsModel(torch.nn.Module):
+        def forward(self, x):
+            return torch.sigmoid(x.mean(dim=1, keepdim=True)).repeat(
+                1, len(WallPredictor.CLASSES), 1, 1
+            )
+
+    monkeypatch.setattr(torch, "load", lambda *args, **kwargs: FakeWallsModel())
@@ -31,7 +31,7 @@ def test_get_upload_url(
     mock_gcp_bucket, mock_gcp_blob, mock_get_unique_name, mock_gcp_client, api_client
 ):
     mock_gcp_client.from_service_account_json.return_value = mock_gcp_client
-    mock_gcp_client.get_bucket.return_value = mock_gcp_bucket
+    mock_gcp_client.bucket.return_value = mock_gcp_bucket
     mock_gcp_bucket.blob.return_value = mock_gcp_blob
     mock_gcp_blob.generate_signed_url.return_value = "signed-url"
 
@@ -45,7 +45,7 @@ def test_get_upload_url(
     mock_gcp_client.from_service_account_json.assert_called_once_with(
         json_credentials_path="/secrets/ml-images-bucket-access.json"
     )
-    mock_gcp_client.get_bucket.assert_called_once_with(bucket_or_name="ml-images-test")
+    mock_gcp_client.bucket.assert_called_once_with(bucket_name="ml-images-test")
     mock_gcp_blob.generate_signed_url.assert_called_once_with(
         version="v4",
         expiration=datetime.timedelta(minutes=5),
@@ -199,3 +199,20 @@ def test_icons_prediction(
             }
         ],
     }
+
+
+@patch.object(main.AsyncResult, "ready", return_value=True)
+@patch.object(main.AsyncResult, "get", return_value={"roi": [[0, 0, 100, 100]]})
+def test_retrieve_results_without_blobs(task_is_ready, task_result, api_client):
+    prediction_results = api_client.get(
+        "/api/retrieve-results/some-fake-task-id.json",
+        follow_redirects=False,
+    )
+    assert prediction_results.status_code == 200
+    assert prediction_results.json() == {"roi": [[0, 0, 100, 100]]}
+
+    prediction_results = api_client.get(
+        "/api/retrieve-results/some-fake-task-id.svg",
+        follow_redirects=False,
+    )
+    assert prediction_results.status_code == 404
@@ -0,0 +1,44 @@
+import os
+
+from common import bucket
+
+
+def test_get_bucket_reuses_client(mock_gcp_client):
+    mock_gcp_client.from_service_account_json.return_value = mock_gcp_client
+
+    assert bucket.get_bucket() is bucket.get_bucket()
+    assert bucket.get_storage_client() is mock_gcp_client
+    mock_gcp_client.from_service_account_json.assert_called_once_with(
+        json_credentials_path="/secrets/ml-images-bucket-access.json"
+    )
+    mock_gcp_client.bucket.assert_called_once_with(bucket_name="ml-images-test")
+    mock_gcp_client.get_bucket.assert_not_called()
+
+
+def test_get_bucket_reset_in_forked_process(mock_gcp_client):
+    mock_gcp_client.from_service_account_json.return_value = mock_gcp_client
+    bucket.get_bucket()
+
+    read_fd, write_fd = os.pipe()
+    if (pid := os.fork()) == 0:
+        bucket.get_bucket()
+        os.write(write_fd, b"%d" % mock_gcp_client.bucket.call_count)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 8) == b"2"
+    assert mock_gcp_client.bucket.call_count == 1
+
+
+def test_get_storage_client_emulator(monkeypatch, mock_gcp_client):
+    from google.auth.credentials import AnonymousCredentials
+
+    monkeypatch.setenv("STORAGE_EMULATOR_HOST", "http://localhost:4443")
+
+    bucket.get_bucket()
+
+    mock_gcp_client.from_service_account_json.assert_not_called()
+    (_, kwargs) = mock_gcp_client.call_args
+    assert isinstance(kwargs["credentials"], AnonymousCredentials)
+    mock_gcp_client.return_value.bucket.assert_called_once_with(
+        bucket_name="ml-images-test"
+    )
@@ -0,0 +1,162 @@
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from shapely.geometry import box
+
+from predictors.tasks.prediction_tasks import prediction_task, roi_task
+from predictors.tasks.utils import cache, storage
+
+
+@pytest.fixture
+def disk_result_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULT_CACHE_BACKEND", "disk")
+    monkeypatch.setenv("RESULT_CACHE_DIRECTORY", tmp_path.as_posix())
+    cache.get_result_cache.cache_clear()
+    yield cache.get_result_cache()
+    cache.get_result_cache.cache_clear()
+
+
+@pytest.fixture
+def uploaded_images(test_file_server, fake_bucket):
+    for image_name in ("image.jpg", "same-image.jpg"):
+        shutil.copy("tests/fixtures/images/1.jpg", Path(test_file_server, image_name))
+
+
+def test_prediction_task_result_cache(
+    monkeypatch, disk_result_cache, uploaded_images, fake_predictor
+):
+    monkeypatch.setattr(prediction_task, "_models", {"icons_v2": fake_predictor})
+    kwargs = dict(
+        input_image={"blob_name": "image.jpg"},
+        model="icons_v2",
+        result_types=["json"],
+        roi=[(0, 0, 100, 100)],
+        pixels_per_meter=40.0,
+    )
+
+    result = prediction_task(**kwargs)
+    assert prediction_task(**kwargs) == result
+    assert (
+        prediction_task(**{**kwargs, "input_image": {"blob_name": "same-image.jpg"}})
+        == result
+    )
+    assert fake_predictor.predict.call_count == 1
+
+    assert prediction_task(**{**kwargs, "pixels_per_meter": 20.0}) != result
+    assert fake_predictor.predict.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "md5_hash, crc32c, generation, expected_fingerprint",
+    [
+        ("bWQ1", "Y3JjMzJj", 1, "md5:bWQ1"),
+        (None, "Y3JjMzJj", 1, "crc32c:Y3JjMzJj:image.jpg:1"),
+        (None, None, None, None),
+    ],
+)
+def test_get_blob_fingerprint(
+    monkeypatch, md5_hash, crc32c, generation, expected_fingerprint
+):
+    blob = MagicMock(md5_hash=md5_hash, crc32c=crc32c, generation=generation)
+    monkeypatch.setattr(
+        storage, "get_bucket", lambda: MagicMock(blob=MagicMock(return_value=blob))
+    )
+
+    assert storage.get_blob_fingerprint("image.jpg") == expected_fingerprint
+    blob.reload.assert_called_once()
+
+
+def test_prediction_task_not_cached_without_fingerprint(
+    monkeypatch, disk_result_cache, uploaded_images, fake_predictor
+):
+    # e.g. a composite object without MD5 hash, CRC32C checksum and generation
+    monkeypatch.setattr(cache, "get_blob_fingerprint", lambda blob_name: None)
+    monkeypatch.setattr(prediction_task, "_models", {"icons_v2": fake_predictor})
+    kwargs = dict(
+        input_image={"blob_name": "image.jpg"},
+        model="icons_v2",
+        result_types=["json"],
+        roi=[(0, 0, 100, 100)],
+    )
+
+    prediction_task(**kwargs)
+    prediction_task(**kwargs)
+
+    assert fake_predictor.predict.call_count == 2
+    assert not list(disk_result_cache.directory.glob("*.json"))
+
+
+def test_prediction_task_cache_key_from_roi_result(
+    monkeypatch, disk_result_cache, uploaded_images, fake_predictor
+):
+    roi_predictor = MagicMock()
+    roi_predictor.predict.return_value = (box(0, 0, 100, 100),)
+    monkeypatch.setattr(
+        prediction_task, "_models", {"roi": roi_predictor, "icons_v2": fake_predictor}
+    )
+    get_blob_fingerprint = MagicMock(wraps=storage.get_blob_fingerprint)
+    monkeypatch.setattr(cache, "get_blob_fingerprint", get_blob_fingerprint)
+    kwargs = dict(
+        input_image={"blob_name": "image.jpg"}, model="icons_v2", result_types=["json"]
+    )
+
+    roi_result = roi_task(input_image=kwargs["input_image"])
+    assert roi_result["input_image_fingerprint"].startswith("md5:")
+    result = prediction_task(roi_result, **kwargs)
+    assert prediction_task(roi_result, **kwargs) == result
+
+    # the image's metadata is only fetched by the roi_task
+    assert get_blob_fingerprint.call_count == 1
+    assert fake_predictor.predict.call_count == 1
+
+
+def test_disk_result_cache_ttl(disk_result_cache):
+    disk_result_cache.set("key", {"json": {"blob_name": "blob"}})
+    assert disk_result_cache.get("key") == {"json": {"blob_name": "blob"}}
+
+    path = disk_result_cache.directory.joinpath("key.json")
+    expired = path.stat().st_mtime - disk_result_cache.ttl - 1
+    os.utime(path, (expired, expired))
+    assert disk_result_cache.get("key") is None
+    assert not path.exists()
+
+
+@pytest.mark.parametrize(
+    "setting, value",
+    [
+        ("PREDICTORS_SKIP_EMPTY_TILES", "False"),
+        ("DETECTRON_TILE_BATCH_SIZE", "8"),
+        ("WALLS_INFERENCE_BACKEND", "onnx"),
+        ("WALLS_ACCUMULATOR_MODE", "blend"),
+    ],
+)
+def test_prediction_cache_key_settings(monkeypatch, setting, value):
+    monkeypatch.setattr(cache, "get_blob_fingerprint", lambda blob_name: "md5:bWQ1")
+    kwargs = dict(
+        input_image={"blob_name": "image.jpg"}, model="walls", result_types=["json"]
+    )
+    key = cache.prediction_cache_key(**kwargs)
+
+    monkeypatch.setenv(setting, value)
+    assert cache.prediction_cache_key(**kwargs) != key
+
+
+def test_prediction_cache_key_model_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "get_blob_fingerprint", lambda blob_name: "md5:bWQ1")
+    monkeypatch.setattr(cache, "MODEL_FILES_DIRECTORY", tmp_path)
+    model_file = tmp_path.joinpath("walls_model_latest.pth")
+    model_file.write_bytes(b"weights")
+    kwargs = dict(
+        input_image={"blob_name": "image.jpg"}, model="walls", result_types=["json"]
+    )
+
+    cache.get_model_files_version.cache_clear()
+    key = cache.prediction_cache_key(**kwargs)
+    # a new model file deployed with the next version of the worker
+    model_file.write_bytes(b"new weights")
+    cache.get_model_files_version.cache_clear()
+    assert cache.prediction_cache_key(**kwargs) != key
+    cache.get_model_files_version.cache_clear()
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("detectron2")
+
+from detectron2.data.transforms import NoOpTransform  # noqa: E402
+from detectron2.structures import Boxes, Instances  # noqa: E402
+
+from predictors.predictors.utils.detectron import TiledPredictor  # noqa: E402
+
+
+class NoResize:
+    def get_transform(self, image):
+        return NoOpTransform()
+
+
+def fake_model(batched_inputs):
+    """Pads the batch with zeros like detectron2's ImageList.from_tensors and
+    predicts one instance per tile, the mask of the dark pixels with the dark
+    fraction of the padded image as score"""
+    height = max(inputs["image"].shape[1] for inputs in batched_inputs)
+    width = max(inputs["image"].shape[2] for inputs in batched_inputs)
+    predictions = []
+    for inputs in batched_inputs:
+        padded_image = torch.zeros((3, height, width))
+        _, tile_height, tile_width = inputs["image"].shape
+        padded_image[:, :tile_height, :tile_width] = inputs["image"]
+        dark = padded_image.mean(dim=0) < 128
+
+        mask = dark[:tile_height, :tile_width]
+        rows, cols = torch.nonzero(mask, as_tuple=True)
+        instances = Instances(image_size=(tile_height, tile_width))
+        instances.pred_masks = mask[None]
+        instances.pred_boxes = Boxes(
+            torch.tensor(
+                [[cols.min(), rows.min(), cols.max() + 1, rows.max() + 1]],
+                dtype=torch.float32,
+            )
+        )
+        instances.pred_classes = torch.tensor([0])
+        instances.scores = dark.float().mean()[None]
+        predictions.append({"instances": instances})
+    return predictions
+
+
+def tiled_predictor(tile_batch_size):
+    # without the config and weights of a real model
+    predictor = TiledPredictor.__new__(TiledPredictor)
+    predictor.tile_size, predictor.max_instance_size = 64, 16
+    predictor.stride = predictor.tile_size - predictor.max_instance_size
+    predictor.merge_threshold = 0.5
+    predictor.tile_batch_size = tile_batch_size
+    predictor.input_format = "BGR"
+    predictor.aug = NoResize()
+    predictor.model = fake_model
+    predictor.skip_empty_tiles = True
+    predictor._transforms = {}
+    return predictor
+
+
+def test_tiled_predictor_batched_instances_same_as_single_tiles():
+    # the border tiles of the image are smaller than the other tiles
+    image = np.full((150, 170, 3), 255, dtype=np.uint8)
+    for row in range(5, 150, 12):
+        for col in range(5, 170, 12):
+            image[row : row + 3, col : col + 3] = 0
+
+    single_instances = tiled_predictor(tile_batch_size=1)(image)["instances"]
+    batched_instances = tiled_predictor(tile_batch_size=4)(image)["instances"]
+
+    assert len(single_instances) > 0
+    assert len(batched_instances) == len(single_instances)
+    np.testing.assert_array_equal(batched_instances.scores, single_instances.scores)
+    np.testing.assert_array_equal(
+        batched_instances.pred_boxes.tensor, single_instances.pred_boxes.tensor
+    )
+    for batched_mask, single_mask in zip(
+        batched_instances.pred_masks, single_instances.pred_masks
+    ):
+        np.testing.assert_array_equal(np.asarray(batched_mask), np.asarray(single_mask))
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from predictors.predictors.utils.geometry import mask_to_shape
+from predictors.predictors.utils.masks import (
+    CroppedMask,
+    cropped_masks_array,
+    group_overlapping_masks,
+)
+
+
+@pytest.fixture
+def dense_masks():
+    masks = np.zeros((3, 1500, 1000), dtype=bool)
+    masks[0, 100:300, 200:260] = True
+    masks[1, 250:320, 230:700] = True
+    masks[1, 290:300, 300:400] = False
+    masks[2, 1400:1500, 900:1000] = True
+    return masks
+
+
+def test_cropped_mask_from_mask(dense_masks):
+    tile = dense_masks[0, 50:400, 150:350]
+    cropped_mask = CroppedMask.from_mask(tile, offset=(50, 150), shape=(1500, 1000))
+
+    assert cropped_mask.bounds == (100, 200, 300, 260)
+    assert cropped_mask.area() == 200 * 60
+    np.testing.assert_array_equal(np.asarray(cropped_mask), dense_masks[0])
+    np.testing.assert_array_equal(
+        cropped_mask[90:110, 190:210], dense_masks[0][90:110, 190:210]
+    )
+
+    empty_mask = CroppedMask.from_mask(np.zeros((10, 10)), shape=(1500, 1000))
+    assert not empty_mask.any()
+    assert not np.asarray(empty_mask).any()
+
+
+def test_cropped_mask_intersection_and_union(dense_masks):
+    cropped_masks = [CroppedMask.from_mask(mask) for mask in dense_masks]
+
+    for mask_i, cropped_mask_i in zip(dense_masks, cropped_masks):
+        for mask_j, cropped_mask_j in zip(dense_masks, cropped_masks):
+            assert cropped_mask_i.intersection_area(cropped_mask_j) == np.sum(
+                mask_i & mask_j
+            )
+            np.testing.assert_array_equal(
+                np.asarray(cropped_mask_i.union(cropped_mask_j)), mask_i | mask_j
+            )
+
+
+def test_mask_to_shape_cropped_mask(dense_masks):
+    pred_masks = cropped_masks_array(
+        [CroppedMask.from_mask(mask) for mask in dense_masks]
+    )
+
+    assert pred_masks.shape == (3,)
+    for mask, cropped_mask in zip(dense_masks, pred_masks):
+        assert mask_to_shape(cropped_mask).equals(mask_to_shape(mask))
+
+
+def test_group_overlapping_masks_matches_dense_pairwise_overlaps():
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    rng = np.random.default_rng(0)
+    shape, threshold = (300, 400), 0.4
+    masks, labels = [], []
+    for row, column, height, width in rng.integers(
+        [0, 0, 5, 5], [260, 360, 60, 60], (120, 4)
+    ):
+        mask = np.zeros(shape, dtype=bool)
+        mask[row : row + height, column : column + width] = True
+        masks.append(mask)
+        labels.append(int(rng.integers(2)))
+    masks = np.array(masks)
+
+    intersections = np.einsum("ihw,jhw->ij", masks.astype(np.int32), masks)
+    areas = np.diag(intersections)
+    connected = (intersections > threshold * np.minimum.outer(areas, areas)) & (
+        np.equal.outer(labels, labels)
+    )
+    _, components = connected_components(coo_matrix(connected), directed=False)
+    expected = {}
+    for i, component in enumerate(components):
+        expected.setdefault(component, []).append(i)
+
+    groups = group_overlapping_masks(
+        masks=[CroppedMask.from_mask(mask) for mask in masks],
+        labels=labels,
+        threshold=threshold,
+    )
+    assert groups == list(expected.values())
+    assert any(len(group) > 2 for group in groups)
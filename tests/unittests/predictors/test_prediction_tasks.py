@@ -0,0 +1,220 @@
+import io
+import json
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+from predictors.predictors.constants import ClassLabel
+from predictors.tasks.prediction_tasks import prediction_task, roi_task
+from predictors.tasks.utils.cache import get_result_cache
+from predictors.tasks.utils.image import DecodedImageCache
+from predictors.tasks.utils.storage import download_blob
+
+
+@pytest.fixture
+def uploaded_image(test_file_server, fake_bucket):
+    shutil.copy("tests/fixtures/images/1.jpg", Path(test_file_server, "image.jpg"))
+    return {"blob_name": "image.jpg"}
+
+
+@pytest.fixture
+def fake_models(monkeypatch, fake_predictor):
+    monkeypatch.delenv("RESULT_CACHE_BACKEND", raising=False)
+    get_result_cache.cache_clear()
+
+    roi_predictor = MagicMock()
+    roi_predictor.predict.return_value = (box(0, 0, 100, 100), box(10, 20, 30, 40))
+    models = {"roi": roi_predictor, "icons_v2": fake_predictor}
+    monkeypatch.setattr(prediction_task, "_models", models)
+    yield models
+    get_result_cache.cache_clear()
+
+
+def test_prediction_task_chained_after_roi_task(uploaded_image, fake_models):
+    roi_result = roi_task(input_image=uploaded_image)
+    assert roi_result == {"roi": [(0, 0, 100, 100), (10, 20, 30, 40)]}
+
+    prediction_result = prediction_task(
+        roi_result, input_image=uploaded_image, model="icons_v2", result_types=["json"]
+    )
+
+    assert fake_models["roi"].predict.call_count == 1
+    assert fake_models["icons_v2"].predict.call_count == 2
+
+    unchained_result = prediction_task(
+        input_image=uploaded_image, model="icons_v2", result_types=["json"]
+    )
+    assert fake_models["roi"].predict.call_count == 2
+    assert download_blob(
+        prediction_result["json"]["blob_name"], "application/json"
+    ) == download_blob(unchained_result["json"]["blob_name"], "application/json")
+
+
+def test_download_image_decoded_image_cache(monkeypatch, uploaded_image):
+    from predictors.tasks.utils import serialization
+
+    download_blob = MagicMock(side_effect=serialization.download_blob)
+    monkeypatch.setattr(serialization, "download_blob", download_blob)
+
+    image = serialization._download_image(uploaded_image["blob_name"], None)
+    cached_image = serialization._download_image(uploaded_image["blob_name"], None)
+
+    assert download_blob.call_count == 1
+    np.testing.assert_array_equal(cached_image, image)
+    # copy on write, the cached file isn't modified
+    cached_image[:] = 0
+    np.testing.assert_array_equal(
+        serialization._download_image(uploaded_image["blob_name"], None), image
+    )
+
+
+def test_decoded_image_cache_eviction(tmp_path):
+    images = [np.full((100, 100, 3), i, dtype=np.uint8) for i in range(4)]
+    cache = DecodedImageCache(directory=tmp_path, max_bytes=2 * images[0].nbytes + 256)
+
+    for i, image in enumerate(images[:2]):
+        cache.set(f"image-{i}", image)
+        os.utime(cache._path(f"image-{i}"), (i, i))
+    cache.get("image-0")  # image-1 is now the least recently used
+    cache.set("image-2", images[2])
+
+    assert cache.get("image-1") is None
+    np.testing.assert_array_equal(cache.get("image-0"), images[0])
+    np.testing.assert_array_equal(cache.get("image-2"), images[2])
+
+
+def test_prediction_result_schema_dump(monkeypatch, test_file_server, fake_bucket):
+    from predictors.tasks.utils import storage
+    from predictors.tasks.utils.serialization import PredictionResultSchema
+
+    # the features are encoded in many chunks, the last one partially filled
+    monkeypatch.setattr(storage, "JSON_CHUNK_ITEMS", 7)
+    geojson = {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "geometry": None, "properties": {"label": str(i)}}
+            for i in range(1000)
+        ],
+    }
+    result = PredictionResultSchema().dump(
+        {"svg": io.BytesIO(b"<svg></svg>"), "json": geojson}
+    )
+
+    assert set(result) == {"svg", "json"}
+    assert result["svg"]["signed_url"].endswith(result["svg"]["blob_name"])
+    assert Path(test_file_server, result["svg"]["blob_name"]).read_bytes() == (
+        b"<svg></svg>"
+    )
+    assert Path(test_file_server, result["json"]["blob_name"]).read_text() == (
+        json.dumps(geojson)
+    )
+    assert download_blob(result["json"]["blob_name"], "application/json") == geojson
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        {"type": "FeatureCollection", "features": []},
+        {"features": [1, 2, 3], "bbox": [], "name": "result"},
+        [{"a": 1}],
+    ],
+)
+def test_json_chunks(monkeypatch, content):
+    from predictors.tasks.utils import storage
+
+    monkeypatch.setattr(storage, "JSON_CHUNK_ITEMS", 2)
+    assert "".join(storage._json_chunks(content)) == json.dumps(content)
+
+
+@pytest.mark.parametrize(
+    "image_shape, expected_size",
+    [
+        ((1000, 2000), ("357.12pt", "178.56pt")),
+        ((3000, 1000), ("88.704pt", "266.112pt")),
+        ((800, 800), ("266.112pt", "266.112pt")),
+    ],
+)
+def test_as_svg(image_shape, expected_size):
+    from xml.etree import ElementTree
+
+    from predictors.predictors.constants import ClassLabel
+    from predictors.tasks.utils.result_content import as_svg
+
+    labels = [ClassLabel.WALL, ClassLabel.DOOR, ClassLabel.WALL]
+    shapes = [
+        box(0, 0, 50, 50).difference(box(10, 10, 20, 20)),
+        box(100, 100, 110, 120),
+        box(200, 0, 210, 10).union(box(300, 0, 310, 10)),
+    ]
+
+    svg = ElementTree.fromstring(as_svg(labels, shapes, image_shape).read())
+
+    namespace = {"svg": "http://www.w3.org/2000/svg"}
+    assert (svg.get("width"), svg.get("height")) == expected_size
+    assert svg.get("viewBox") == f"0 0 {image_shape[1]} {image_shape[0]}"
+    groups = svg.findall("svg:g", namespace)
+    assert [group.get("id") for group in groups] == ["WALL", "DOOR"]
+    assert groups[0].get("style").startswith("fill: #2a79a1; fill-opacity: 0.7")
+    assert len(groups[0].findall("svg:path", namespace)) == 3
+    assert groups[1].find("svg:path", namespace).get("d") == (
+        "M 110.00 100.00 L 110.00 120.00 L 100.00 120.00 L 100.00 100.00 Z"
+    )
+    # the hole is a subpath of the polygon's path
+    assert groups[0].find("svg:path", namespace).get("d").count("M") == 2
+
+
+def test_wkb_result_type(uploaded_image, fake_models):
+    from predictors.tasks.prediction_tasks import statistics_task
+    from predictors.tasks.utils.result_content import from_geojson, from_wkb
+
+    result = prediction_task(
+        input_image=uploaded_image, model="icons_v2", result_types=["json", "wkb"]
+    )
+
+    labels, shapes = from_wkb(download_blob(result["wkb"]["blob_name"]))
+    expected_labels, expected_shapes = from_geojson(
+        download_blob(result["json"]["blob_name"], "application/json")
+    )
+    assert labels == expected_labels
+    assert all(map(lambda a, b: a.equals_exact(b, 0), shapes, expected_shapes))
+
+    # the statistics are the same whether computed from the wkb or the json
+    json_result = {"json": result["json"]}
+    assert download_blob(
+        statistics_task([result])["json"]["blob_name"], "application/json"
+    ) == download_blob(
+        statistics_task([json_result])["json"]["blob_name"], "application/json"
+    )
+
+
+def test_prediction_geometries_schema_loads_only_wkb(monkeypatch):
+    from predictors.tasks.utils import serialization
+    from predictors.tasks.utils.result_content import as_wkb
+
+    labels, shapes = (ClassLabel.WALL, ClassLabel.DOOR), (
+        box(0, 0, 1, 1),
+        box(2, 2, 3, 3),
+    )
+    downloads = []
+
+    def download(blob_name, content_type=None):
+        downloads.append(blob_name)
+        return as_wkb(labels, shapes).read()
+
+    monkeypatch.setattr(
+        serialization.PredictionGeometriesSchema._declared_fields["wkb"],
+        "download",
+        download,
+    )
+
+    (result,) = serialization.PredictionGeometriesSchema(many=True).load(
+        [{"json": {"blob_name": "result.json"}, "wkb": {"blob_name": "result.wkb"}}]
+    )
+
+    assert downloads == ["result.wkb"]
+    assert set(result) == {"wkb"}
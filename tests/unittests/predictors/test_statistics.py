@@ -0,0 +1,44 @@
+import pytest
+from shapely.geometry import GeometryCollection, MultiPolygon, Polygon, box
+
+from predictors.predictors.constants import ClassLabel
+from predictors.tasks.statistics import PIXEL_TO_METER_RATIO, calculate_stats
+
+
+def test_calculate_stats():
+    labels, shapes = zip(
+        # a bathroom with a toilet, a room and a room overlapping it
+        (ClassLabel.SPACE, box(0, 0, 400, 400)),
+        (ClassLabel.TOILET, box(10, 10, 50, 50)),
+        (ClassLabel.SPACE, box(400, 0, 800, 400)),
+        (ClassLabel.SPACE, box(600, 0, 1000, 400)),
+        # the overlap of walls only adds once to the wall space
+        (ClassLabel.WALL, box(0, 0, 1000, 20)),
+        (ClassLabel.WALL, box(0, 0, 20, 400)),
+        (ClassLabel.WALL, box(1000, 0, 1020, 400)),
+        (ClassLabel.WALL, box(0, 1000, 100, 1020)),
+        # multi polygons, collections and empty shapes
+        (
+            ClassLabel.DOOR,
+            MultiPolygon([box(0, 500, 40, 540), box(100, 500, 140, 540)]),
+        ),
+        (ClassLabel.DOOR, GeometryCollection([box(200, 500, 240, 540)])),
+        (ClassLabel.WINDOW, Polygon()),
+    )
+
+    stats = calculate_stats(labels, shapes)
+
+    square_meters = PIXEL_TO_METER_RATIO**2
+    assert stats["room_count"] == 2
+    assert stats["bathroom_count"] == 1
+    assert stats["room_space"] == pytest.approx(600 * 400 / square_meters)
+    assert stats["bathroom_space"] == pytest.approx(400 * 400 / square_meters)
+    assert stats["toilet_count"] == 1
+    assert stats["wall_space"] == pytest.approx(
+        (1020 * 20 + 20 * 380 + 20 * 380 + 100 * 20) / square_meters
+    )
+    assert stats["door_count"] == 3
+    assert stats["door_space"] == pytest.approx(3 * 40 * 40 / square_meters)
+    assert stats["window_count"] == 0
+    assert stats["window_space"] == 0
+    assert stats["sink_count"] == 0
@@ -0,0 +1,542 @@
+import numpy as np
+import pytest
+import torch
+
+from predictors.predictors.utils.geometry import (
+    get_segment_intersections,
+    mask_to_shape,
+)
+from predictors.predictors.utils.inference import export_onnx, export_torchscript
+from predictors.predictors.utils.tiling import (
+    EmptyTileScreen,
+    TileMaskAccumulator,
+    get_image_tile_bounds,
+)
+from predictors.predictors.walls import SegmentationLabel, WallPredictor
+
+
+@pytest.fixture
+def random_image():
+    return np.random.default_rng(42).integers(0, 255, (2000, 1500, 3), dtype="uint8")
+
+
+@pytest.mark.parametrize("tile_batch_size", [1, 3, 16])
+def test_predict_tiled_batched(tile_batch_size, random_image, fake_walls_model):
+    unbatched_mask = WallPredictor(tile_batch_size=1).predict_tiled(random_image)
+    batched_mask = WallPredictor(tile_batch_size=tile_batch_size).predict_tiled(
+        random_image
+    )
+
+    assert batched_mask.shape == (len(WallPredictor.CLASSES), 2000, 1500)
+    np.testing.assert_array_equal(batched_mask, unbatched_mask)
+
+
+@pytest.mark.parametrize("accumulator_mode", TileMaskAccumulator.MODES)
+@pytest.mark.parametrize(
+    "accumulator_dtype, atol", [(np.float16, 1e-3), (np.uint8, 1 / 255)]
+)
+def test_predict_tiled_accumulator(
+    accumulator_mode, accumulator_dtype, atol, random_image, fake_walls_model
+):
+    predictor = WallPredictor(
+        accumulator_mode=accumulator_mode, accumulator_dtype=accumulator_dtype
+    )
+    # the fake model predicts every pixel independently, so no matter how the tile
+    # overlaps are resolved the result has to match a prediction of the whole image
+    expected_mask = predictor.model(
+        torch.from_numpy(predictor.preprocess(random_image))[None]
+    )[0]
+    mask = predictor.predict_tiled(random_image)
+
+    assert mask.dtype == np.float16
+    np.testing.assert_allclose(mask, expected_mask, atol=atol)
+
+
+@pytest.mark.parametrize("width", [1024, 1800, 1900, 1950, 2000, 2700])
+def test_tile_mask_accumulator_windows(width):
+    accumulator = TileMaskAccumulator(
+        width=width, height=1, classes=1, tile_size=1024, tile_overlap=128
+    )
+    tile_bounds = list(
+        get_image_tile_bounds(width=width, height=1, tile_size=1024, tile_stride=896)
+    )
+    owners = np.zeros(width, dtype=int)
+    for tile_index, (x1, y1, x2, y2) in enumerate(tile_bounds):
+        wx1, _, wx2, _ = accumulator._owned_window(x1, y1, x2, y2)
+        owners[wx1:wx2] += 1
+        # every pixel is owned by the tile with the most context around it
+        for x in range(wx1, wx2):
+            context = min(
+                x - x1 if x1 > 0 else width, x2 - 1 - x if x2 < width else width
+            )
+            for other_x1, _, other_x2, _ in tile_bounds:
+                if other_x1 <= x < other_x2:
+                    other_context = min(
+                        x - other_x1 if other_x1 > 0 else width,
+                        other_x2 - 1 - x if other_x2 < width else width,
+                    )
+                    assert context >= other_context - 1
+
+    np.testing.assert_array_equal(owners, 1)
+
+
+def test_tile_mask_accumulator_invalid_mode(fake_walls_model):
+    with pytest.raises(ValueError):
+        TileMaskAccumulator(
+            width=10, height=10, classes=1, tile_size=8, tile_overlap=2, mode="mean"
+        )
+    with pytest.raises(ValueError):
+        WallPredictor(accumulator_mode="mean")
+
+
+def test_empty_tile_screen_ink_pixels(random_image):
+    screen = EmptyTileScreen(random_image, ink_threshold=100, max_ink_pixels=0)
+    ink = (random_image < 100).any(axis=2)
+
+    for x1, y1, x2, y2 in [
+        (0, 0, 2000, 1500),
+        (13, 1000, 14, 1500),
+        (896, 0, 1920, 1024),
+    ]:
+        assert screen.ink_pixels(x1, y1, x2, y2) == ink[x1:x2, y1:y2].sum()
+    assert not screen.is_empty(0, 0, 10, 10)
+    assert screen.is_empty(5, 5, 5, 10)
+    assert screen.skip_rate == 0.5
+
+
+def test_predict_tiled_skips_empty_tiles(monkeypatch, fake_walls_model):
+    image = np.full((3000, 2000, 3), 255, dtype=np.uint8)
+    image[1200:1400, 300:900] = 0
+    image[2500:2505, 1900:1905] = 100  # speckles are not ink
+
+    predictor = WallPredictor()
+    predicted_tiles = []
+    predict_tile_batch = predictor.predict_tile_batch
+
+    def count_predict_tile_batch(tiles):
+        predicted_tiles.extend(tiles)
+        return predict_tile_batch(tiles)
+
+    monkeypatch.setattr(predictor, "predict_tile_batch", count_predict_tile_batch)
+    mask = predictor.predict_tiled(image)
+    assert len(predicted_tiles) == 2
+
+    expected_mask = WallPredictor(skip_empty_tiles=False).predict_tiled(image)
+    np.testing.assert_array_equal(
+        mask[:, 1200:1400, 300:900], expected_mask[:, 1200:1400, 300:900]
+    )
+    empty_tile_mask = np.zeros(len(WallPredictor.CLASSES))
+    empty_tile_mask[SegmentationLabel.BACKGROUND.value] = 1
+    np.testing.assert_array_equal(
+        mask[:, 2200:, 1200:], empty_tile_mask[:, None, None] + np.zeros((800, 800))
+    )
+
+
+def test_preprocess_matches_encoder_preprocessing(random_image, fake_walls_model):
+    import segmentation_models_pytorch as smp
+
+    predictor = WallPredictor()
+    expected = (
+        smp.encoders.get_preprocessing_fn(
+            WallPredictor.ENCODER, WallPredictor.ENCODER_WEIGHTS
+        )(random_image)
+        .transpose(2, 0, 1)
+        .astype("float32")
+    )
+
+    np.testing.assert_allclose(predictor.preprocess(random_image), expected, atol=1e-5)
+    np.testing.assert_allclose(
+        predictor.preprocess_batch(random_image[None]).cpu().numpy()[0],
+        expected,
+        atol=1e-5,
+    )
+
+
+@pytest.mark.parametrize(
+    "backend, export",
+    [("torchscript", export_torchscript), ("onnx", export_onnx)],
+)
+def test_predict_tiled_exported_backends(
+    backend, export, random_image, fake_walls_model, tmp_path
+):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+
+    export(
+        model=torch.load(WallPredictor.TORCH_MODEL_PATH),
+        output_path=tmp_path.joinpath("walls_model"),
+        tile_size=WallPredictor.TILE_SIZE,
+    )
+    exported_predictor = WallPredictor(
+        model_path=tmp_path.joinpath("walls_model"), backend=backend, num_threads=1
+    )
+
+    np.testing.assert_allclose(
+        exported_predictor.predict_tiled(random_image),
+        WallPredictor().predict_tiled(random_image),
+        atol=1e-3,
+    )
+
+
+def test_quantize_walls_model(tmp_path):
+    import segmentation_models_pytorch as smp
+
+    from predictors.predictors.utils.inference import TorchScriptBackend
+    from predictors.predictors.utils.quantization import quantize_walls_model
+
+    torch.manual_seed(42)
+    model = smp.DeepLabV3Plus(
+        encoder_name="resnet18", encoder_weights=None, classes=8
+    ).eval()
+    batches = [torch.rand(2, 3, 128, 128) for _ in range(4)]
+
+    quantized_model = quantize_walls_model(model=model, calibration_batches=batches)
+    torch.jit.save(quantized_model, tmp_path.joinpath("walls_model.pt").as_posix())
+    backend = TorchScriptBackend(
+        model_path=tmp_path.joinpath("walls_model.pt"), device="cpu", num_threads=1
+    )
+
+    with torch.inference_mode():
+        expected = model(batches[0]).numpy()
+    quantized = backend(batches[0])
+    assert quantized.shape == expected.shape
+    assert np.abs(quantized - expected).mean() < 0.1 * np.abs(expected).mean()
+
+
+def test_get_segment_intersections_matches_scaled_shapely_intersections():
+    from shapely.affinity import scale
+    from shapely.geometry import LineString, Point
+
+    rng = np.random.default_rng(42)
+    segments = rng.integers(0, 200, (150, 2, 2))
+    # axis aligned segments as found by the hough transform on floorplans
+    segments[:50, 1, 1] = segments[:50, 0, 1]
+    segments[50:100, 1, 0] = segments[50:100, 0, 0]
+    segments = segments[np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1) > 5]
+
+    expected = []
+    lines = [
+        scale(line, 1 + 20 / line.length, 1 + 20 / line.length)
+        for line in map(LineString, segments)
+    ]
+    for i, line in enumerate(lines):
+        for other_line in lines[i + 1 :]:
+            intersection = line.intersection(other_line)
+            if isinstance(intersection, Point) and not intersection.is_empty:
+                expected.append(intersection.coords[0])
+
+    np.testing.assert_allclose(
+        get_segment_intersections(segments, extension=20, chunk_size=16),
+        np.array(expected),
+    )
+
+
+def test_mask_to_shape_matches_find_contours():
+    from shapely.geometry import Polygon
+    from shapely.ops import unary_union
+    from skimage import measure
+
+    mask = np.zeros((3000, 2000), dtype=bool)
+    mask[100:160, 1200:1900] = True
+    mask[140:900, 1820:1900] = True
+    mask[2500:2600, 10:80] = True
+    mask[2520:2580, 30:60] = False  # holes are closed
+
+    expected = unary_union(
+        [
+            Polygon(np.round(np.flip(contour, axis=1)))
+            for contour in measure.find_contours(mask, 0.99)
+        ]
+    )
+    for mask_like in (mask, mask.astype(np.float32), torch.from_numpy(mask)):
+        shape = mask_to_shape(mask_like)
+        assert shape.geom_type == "MultiPolygon"
+        assert shape.symmetric_difference(expected).area == pytest.approx(0.0)
+
+    assert mask_to_shape(np.zeros_like(mask)).is_empty
+
+
+def test_mask_to_shape_diagonally_touching_pixels():
+    mask = np.zeros((100, 100), dtype=bool)
+    mask[10:60, 10:60] = True
+    mask[60:62, 60:62] = True
+
+    shape = mask_to_shape(mask)
+    assert shape.is_valid
+    assert shape.area == pytest.approx(49 * 49 + 1)
+
+
+def test_get_line_corners_matches_shapely_projections():
+    from shapely import STRtree, points
+    from shapely.geometry import LineString, Point
+
+    from predictors.predictors.walls import MaskPostprocessor
+
+    rng = np.random.default_rng(42)
+    corners = rng.uniform(0, 500, (1000, 2))
+    corner_tree = STRtree(points(corners))
+
+    for line in [LineString(rng.uniform(0, 500, (2, 2))) for _ in range(50)]:
+        expected = sorted(
+            [
+                line.interpolate(line.project(corner))
+                for corner in map(Point, corners)
+                if line.distance(corner) < 10
+            ],
+            key=line.project,
+        )
+        np.testing.assert_allclose(
+            MaskPostprocessor._get_line_corners(
+                line=line,
+                corners=corners,
+                corner_tree=corner_tree,
+                max_distance=10,
+            ),
+            np.array([corner.coords[0] for corner in expected]).reshape(-1, 2),
+        )
+
+
+def test_get_segment_width_percentiles_matches_profile_line():
+    from skimage.measure import profile_line
+
+    from predictors.predictors.walls import MaskPostprocessor
+
+    rng = np.random.default_rng(42)
+    medial_axis_distance = rng.uniform(0, 10, (300, 200))
+    segments = rng.uniform(0, 200, (100, 2, 2))
+
+    expected = np.array(
+        [
+            np.percentile(
+                profile_line(
+                    image=medial_axis_distance.T, src=segment[0], dst=segment[1]
+                ),
+                [50, 25],
+            )
+            for segment in segments
+        ]
+    ).T
+    np.testing.assert_allclose(
+        MaskPostprocessor._get_segment_width_percentiles(
+            medial_axis_distance=medial_axis_distance,
+            segments=segments,
+            percentiles=[50, 25],
+        ),
+        expected,
+    )
+
+
+@pytest.fixture
+def deterministic_hough_lines(monkeypatch):
+    """The probabilistic hough transform is random, the lines found are replayed
+    for the same skeleton instead
+    """
+    from skimage.transform import probabilistic_hough_line
+
+    hough_lines = {}
+
+    def fixed_probabilistic_hough_line(image, *args, **kwargs):
+        key = (image.shape, image.tobytes())
+        if key not in hough_lines:
+            hough_lines[key] = probabilistic_hough_line(image, *args, **kwargs)
+        return hough_lines[key]
+
+    monkeypatch.setattr(
+        "predictors.predictors.walls.probabilistic_hough_line",
+        fixed_probabilistic_hough_line,
+    )
+
+
+@pytest.fixture
+def walls_mask():
+    mask = np.zeros((400, 600), dtype=np.float32)
+    mask[50:60, 50:550] = 1
+    mask[340:350, 50:550] = 1
+    mask[50:350, 50:60] = 1
+    mask[50:350, 300:306] = 1
+    mask[50:350, 540:550] = 1
+    return mask
+
+
+def test_get_rectangles_workers(walls_mask, deterministic_hough_lines):
+    from predictors.predictors.walls import MaskPostprocessor
+
+    rectangles = MaskPostprocessor.get_rectangles(mask=walls_mask)
+    threaded_rectangles = MaskPostprocessor.get_rectangles(mask=walls_mask, workers=4)
+
+    assert rectangles
+    assert len(rectangles) == len(threaded_rectangles)
+    assert all(
+        rectangle.equals_exact(other, 1e-9)
+        for rectangle, other in zip(rectangles, threaded_rectangles)
+    )
+
+
+def full_mask_rectangles(mask, **parameters):
+    """The rectangles of the mask with the skeleton and the medial axis distance
+    computed on the full mask instead of its crops"""
+    from skimage.morphology import medial_axis, skeletonize
+
+    from predictors.predictors.walls import MaskPostprocessor
+
+    mask = mask.astype(np.uint8)
+    _, medial_axis_distance = medial_axis(mask, return_distance=True)
+    return MaskPostprocessor._buffer_segments(
+        *MaskPostprocessor._get_segments(
+            skeleton=skeletonize(mask, method="lee"),
+            medial_axis_distance=medial_axis_distance,
+            **{**MaskPostprocessor.DEFAULT_PARAMETERS, **parameters},
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "parameters",
+    [{}, dict(segment_min_width=0.5, segment_min_length=5)],
+)
+def test_get_rectangles_crops(walls_mask, deterministic_hough_lines, parameters):
+    from shapely.geometry import box
+
+    from predictors.predictors.walls import MaskPostprocessor
+
+    mask = np.zeros((2000, 3000), dtype=np.float32)
+    mask[1000:1400, 2000:2600] = walls_mask
+    mask[100:500, 100:700] = walls_mask
+    # a wall with a gap wider than the crop margin, in line with the walls above
+    mask[150:160, 800:1200] = 1
+    mask[150:160, 1300:1600] = 1
+    mask[150:450, 1000:1010] = 1
+    mask[150:450, 1590:1600] = 1
+    mask[1800:1803, 200:203] = 1
+
+    crops = list(MaskPostprocessor._get_crops(mask=mask.astype(np.uint8), margin=20))
+    assert len(crops) == 5
+
+    rectangles = MaskPostprocessor.get_rectangles(mask=mask, **parameters)
+    expected_rectangles = full_mask_rectangles(mask > 0.5, **parameters)
+    assert rectangles
+    assert len(rectangles) == len(expected_rectangles)
+    assert all(
+        rectangle.equals_exact(expected, 1e-9)
+        for rectangle, expected in zip(rectangles, expected_rectangles)
+    )
+    # segments between the crops are kept, e.g. across the gap
+    assert any(
+        rectangle.intersects(box(1200, 150, 1300, 160)) for rectangle in rectangles
+    )
+
+
+def test_get_multiclass_rectangles(walls_mask, deterministic_hough_lines):
+    from predictors.predictors.walls import MaskPostprocessor
+
+    railings_mask = np.zeros_like(walls_mask)
+    railings_mask[200:203, 100:250] = 1
+    railings_mask[200:300, 100:103] = 1
+    railings_mask[300:303, 100:250] = 1
+    railings_mask[200:303, 250:253] = 1
+    parameters = [{}, dict(segment_min_width=0.5, segment_min_length=5)]
+
+    multiclass_rectangles = MaskPostprocessor.get_multiclass_rectangles(
+        masks=[walls_mask.astype(np.uint8), railings_mask.astype(np.uint8)],
+        parameters=parameters,
+    )
+
+    for mask, mask_parameters, rectangles in zip(
+        [walls_mask, railings_mask], parameters, multiclass_rectangles
+    ):
+        expected = MaskPostprocessor.get_rectangles(mask=mask, **mask_parameters)
+        assert rectangles
+        assert len(rectangles) == len(expected)
+        assert all(
+            rectangle.equals_exact(other, 1e-9)
+            for rectangle, other in zip(rectangles, expected)
+        )
+
+
+def test_get_wall_and_railing_masks():
+    from skimage.morphology import dilation, square
+
+    from predictors.predictors.walls import SegmentationLabel
+
+    pred_mask = np.random.default_rng(42).random((8, 300, 200)).astype(np.float16)
+    expected_walls_mask = np.clip(
+        np.maximum.reduce(
+            [
+                pred_mask[SegmentationLabel.SEPARATORS.value],
+                pred_mask[SegmentationLabel.WALLS.value],
+                pred_mask[SegmentationLabel.OPENINGS.value],
+                pred_mask[SegmentationLabel.DOORS.value],
+                pred_mask[SegmentationLabel.WINDOWS.value],
+            ]
+        )
+        - dilation(
+            pred_mask[SegmentationLabel.RAILINGS.value].astype(np.float32), square(3)
+        ),
+        0,
+        1,
+    )
+
+    walls_mask, railings_mask = WallPredictor.get_wall_and_railing_masks(pred_mask)
+
+    np.testing.assert_array_equal(walls_mask, expected_walls_mask > 0.08)
+    np.testing.assert_array_equal(
+        railings_mask, pred_mask[SegmentationLabel.RAILINGS.value] > 0.5
+    )
+
+
+def test_adjust_openings_to_walls():
+    from shapely.geometry import box
+
+    walls = (box(0, 0, 100, 10), box(95, -50, 105, 60))
+    openings = [
+        box(40, -1, 60, 11),
+        # intersects both walls, but overlaps the first one the most
+        box(80, -1, 100, 11),
+        box(200, 200, 210, 210),
+    ]
+
+    adjusted_openings = WallPredictor.adjust_openings_to_walls(
+        openings=openings, walls=walls
+    )
+
+    assert len(adjusted_openings) == 2
+    for adjusted_opening, opening in zip(adjusted_openings, openings):
+        assert adjusted_opening.equals(
+            WallPredictor.adjust_geometry_to_wall(opening=opening, wall=walls[0])
+        )
+    assert WallPredictor.adjust_openings_to_walls(openings=openings, walls=()) == []
+
+
+def test_adjust_geometries_to_walls_matches_adjust_geometry_to_wall():
+    from shapely.affinity import rotate
+    from shapely.geometry import Polygon, box
+
+    rng = np.random.default_rng(42)
+    openings, walls = [], []
+    for i in range(200):
+        angle = rng.uniform(0, 180)
+        walls.append(
+            rotate(box(0, 0, rng.uniform(50, 300), rng.uniform(5, 30)), angle, (0, 0))
+        )
+        x, y = rng.uniform(0, 40), rng.uniform(-10, 10)
+        width, height = rng.uniform(5, 40), rng.uniform(2, 50)
+        if i % 5:
+            opening = rotate(
+                box(x, y, x + width, y + height), angle + rng.normal(0, 3), (0, 0)
+            )
+        else:
+            opening = Polygon(
+                [(x, y), (x + width, y), (x + width * 0.7, y + height), (x, y + height)]
+            )
+        openings.append(opening)
+
+    adjusted_openings = WallPredictor.adjust_geometries_to_walls(
+        openings=np.array(openings), walls=np.array(walls)
+    )
+
+    for adjusted_opening, opening, wall in zip(adjusted_openings, openings, walls):
+        expected = WallPredictor.adjust_geometry_to_wall(opening=opening, wall=wall)
+        if expected is None or expected.is_empty:
+            assert adjusted_opening is None or adjusted_opening.is_empty
+        else:
+            assert adjusted_opening.symmetric_difference(expected).area < 1e-6